@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import os
 import sys
 
@@ -24,13 +25,32 @@ async def lifespan(app: FastAPI):
     # 启动时加载模型
     from app.services.image_generator import image_generator
     from app.services.prompt_optimizer import prompt_optimizer
+    from app.services.upload_gc import upload_gc
+    from app.services.image_processor import image_processor
     
     # 预加载模型（可选，延迟到首次使用时）
     print("🚀 AI Meme Generator Backend Started")
     print(f"📁 Static files: {STATIC_DIR}")
     print(f"📁 Upload directory: {UPLOAD_DIR}")
+    upload_gc.start()
+    # 解析字体文件较慢，放到线程池中预加载
+    await asyncio.to_thread(image_processor.preload_fonts)
     yield
     # 清理资源
+    from app.services.http_client import http_client
+    from app.services.result_cache import generation_cache
+    from app.services.job_manager import job_manager
+    from app.models.meme import meme_storage
+    from app.services.image_hash import output_hashes, template_hashes
+
+    await upload_gc.stop()
+    await job_manager.shutdown()
+    await http_client.aclose()
+    generation_cache.flush()
+    template_hashes.flush()
+    output_hashes.flush()
+    # 写入缓冲中尚未落盘的历史记录后关闭数据库
+    meme_storage.close()
     print("👋 Shutting down...")
 
 
@@ -48,6 +68,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Latest-Cursor"],
 )
 
 # 静态文件服务 - 使用绝对路径
@@ -2,10 +2,20 @@
 表情包数据模型和存储
 """
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 from datetime import datetime
 import json
 import os
+import sqlite3
+import threading
+import time
+
+
+def _image_name(url: str) -> Optional[str]:
+    """图片 URL 对应的文件名（去掉查询参数），用于按文件名查找引用"""
+    if not url:
+        return None
+    return url.split("?", 1)[0].rsplit("/", 1)[-1] or None
 
 
 class MemeRecord(BaseModel):
@@ -22,55 +32,360 @@ class MemeRecord(BaseModel):
 
 
 class MemeStorage:
-    """表情包存储（使用JSON文件）"""
+    """
+    表情包存储（SQLite，WAL 模式）
 
-    def __init__(self, storage_path: str = "meme_history.json"):
-        self.storage_path = storage_path
-        self._ensure_file_exists()
+    - 按 id 插入 / 查询 / 删除走主键索引，不再整文件读写
+    - 保留条数由 MEME_HISTORY_LIMIT 控制（0 表示不限制）
+    - 首次启动时从旧的 meme_history.json 一次性迁移
+    - 写后缓冲：save() 只写入内存缓冲并立即返回，后台线程攒够条数或超过时间后
+      在一个事务里批量写入（每批只 fsync 一次）；读取时合并未落盘的记录，关闭时保证全部写入
+    """
 
-    def _ensure_file_exists(self):
-        if not os.path.exists(self.storage_path):
-            with open(self.storage_path, "w", encoding="utf-8") as f:
-                json.dump([], f)
+    def __init__(
+        self,
+        storage_path: str = "meme_history.json",
+        db_path: Optional[str] = None,
+        limit: Optional[int] = None,
+    ):
+        # storage_path 为旧版 JSON 文件，仅用于迁移
+        self.storage_path = storage_path
+        self.db_path = db_path or os.getenv("MEME_HISTORY_DB") or os.path.join(
+            os.path.dirname(storage_path), "meme_history.db"
+        )
+        self.limit = limit if limit is not None else int(os.getenv("MEME_HISTORY_LIMIT", "100"))
+        self.flush_batch = max(1, int(os.getenv("MEME_HISTORY_FLUSH_BATCH", "32")))
+        self.flush_interval = float(os.getenv("MEME_HISTORY_FLUSH_INTERVAL", "1.0"))
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # 未落盘的记录：id → (seq, 记录)，按写入顺序
+        self._pending: Dict[str, Tuple[int, MemeRecord]] = {}
+        self._pending_since = 0.0
+        self._next_seq = 0
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = False
+        self.flushes = 0
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._init_db()
+        self._migrate_json()
+        with self._lock:
+            # seq 在写入缓冲时预先分配，保证未落盘记录的游标与落盘后一致
+            row = self._conn.execute(
+                "SELECT MAX(seq) FROM (SELECT MAX(seq) AS seq FROM memes "
+                "UNION ALL SELECT seq FROM sqlite_sequence WHERE name = 'memes')"
+            ).fetchone()
+            self._next_seq = (row[0] or 0) + 1
 
-    def save(self, record: MemeRecord) -> None:
-        """保存记录"""
-        records = self.get_all()
-        records.insert(0, record)
-        # 只保留最近100条
-        records = records[:100]
-        with open(self.storage_path, "w", encoding="utf-8") as f:
-            json.dump([r.dict() for r in records], f, ensure_ascii=False, indent=2)
+    def _init_db(self):
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # FULL：每个批量事务提交时 fsync 一次，已落盘的批次断电也不丢
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS memes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT NOT NULL UNIQUE,
+                    created_at TEXT NOT NULL,
+                    style TEXT,
+                    provider TEXT,
+                    is_mock INTEGER NOT NULL DEFAULT 0,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_memes_style ON memes (style, seq);
+                CREATE INDEX IF NOT EXISTS idx_memes_provider ON memes (provider, seq);
+                CREATE INDEX IF NOT EXISTS idx_memes_is_mock ON memes (is_mock, seq);
+                CREATE INDEX IF NOT EXISTS idx_memes_created_at ON memes (created_at);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                """
+            )
+            # 图片文件名列：上传目录回收按文件名批量查询引用，不再读取全部 URL
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(memes)")}
+            if "image_name" not in columns:
+                self._conn.execute("ALTER TABLE memes ADD COLUMN image_name TEXT")
+                rows = self._conn.execute(
+                    "SELECT seq, json_extract(data, '$.imageUrl') FROM memes"
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE memes SET image_name = ? WHERE seq = ?",
+                    [(_image_name(url), seq) for seq, url in rows],
+                )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_memes_image_name ON memes (image_name)"
+            )
+            self._conn.commit()
 
-    def get_all(self) -> List[MemeRecord]:
-        """获取所有记录"""
-        if not os.path.exists(self.storage_path):
-            return []
+    def _migrate_json(self):
+        """把旧版 JSON 历史导入数据库（只执行一次，原文件保留）"""
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+        if done or not os.path.exists(self.storage_path):
+            return
         try:
             with open(self.storage_path, "r", encoding="utf-8") as f:
                 data = json.load(f)
-            return [MemeRecord(**item) for item in data]
-        except Exception:
-            return []
+            records = [MemeRecord(**item) for item in data]
+        except Exception as e:
+            print(f"⚠️ Meme history migration skipped: {e}")
+            records = []
+
+        with self._lock:
+            # JSON 中最新的在前，倒序插入保持 seq 顺序
+            for record in reversed(records):
+                self._insert(record)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.utcnow().isoformat(),),
+            )
+            self._apply_retention()
+            self._conn.commit()
+        if records:
+            print(f"📦 Migrated {len(records)} history records from {self.storage_path}")
+
+    @staticmethod
+    def _row(record: MemeRecord, seq: Optional[int] = None) -> tuple:
+        return (
+            seq,
+            record.id,
+            record.createdAt,
+            record.style,
+            record.provider,
+            int(record.isMock),
+            json.dumps(record.dict(), ensure_ascii=False),
+            _image_name(record.imageUrl),
+        )
+
+    def _insert(self, record: MemeRecord) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO memes "
+            "(seq, id, created_at, style, provider, is_mock, data, image_name) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            self._row(record),
+        )
+
+    def _apply_retention(self) -> None:
+        if self.limit <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM memes WHERE seq <= ("
+            "SELECT seq FROM memes ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+            (self.limit,),
+        )
+
+    def save(self, record: MemeRecord) -> None:
+        """保存记录（写入缓冲后立即返回）"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MemeStorage is closed")
+            self._pending.pop(record.id, None)
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending[record.id] = (self._next_seq, record)
+            self._next_seq += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, name="meme-history-flusher", daemon=True
+                )
+                self._flusher.start()
+            if len(self._pending) == 1 or len(self._pending) >= self.flush_batch:
+                self._cond.notify()
+
+    def _flush_loop(self) -> None:
+        with self._cond:
+            while not self._closed:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                remaining = self._pending_since + self.flush_interval - time.monotonic()
+                if len(self._pending) < self.flush_batch and remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                try:
+                    self._flush_locked()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Meme history flush failed: {e}")
+                    self._cond.wait(self.flush_interval)
+
+    def _flush_locked(self) -> None:
+        """把缓冲中的记录在一个事务里写入（调用方持有锁）"""
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO memes "
+                "(seq, id, created_at, style, provider, is_mock, data, image_name) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._row(record, seq) for seq, record in self._pending.values()],
+            )
+            self._apply_retention()
+        self._pending.clear()
+        self.flushes += 1
+
+    def flush(self) -> None:
+        """立即写入所有未落盘记录"""
+        with self._lock:
+            self._flush_locked()
+
+    def _pending_newest_first(self) -> List[Tuple[int, MemeRecord]]:
+        return sorted(self._pending.values(), key=lambda item: item[0], reverse=True)
+
+    def get_all(self) -> List[MemeRecord]:
+        """获取所有记录（最新的在前）"""
+        with self._lock:
+            pending = self._pending_newest_first()
+            rows = self._conn.execute("SELECT id, data FROM memes ORDER BY seq DESC").fetchall()
+            pending_ids = set(self._pending)
+        records = [record for _, record in pending]
+        records.extend(
+            MemeRecord(**json.loads(data)) for meme_id, data in rows if meme_id not in pending_ids
+        )
+        if self.limit > 0:
+            records = records[: self.limit]
+        return records
+
+    def query(
+        self,
+        limit: int = 100,
+        cursor: Optional[int] = None,
+        since: Optional[int] = None,
+        style: Optional[str] = None,
+        provider: Optional[str] = None,
+        is_mock: Optional[bool] = None,
+        created_after: Optional[str] = None,
+        created_before: Optional[str] = None,
+    ) -> Tuple[List[Tuple[int, MemeRecord]], bool]:
+        """
+        分页查询（最新的在前），返回 ([(seq, 记录)], 是否还有更早的记录)
+
+        cursor: 只返回 seq 小于该值的记录（翻到下一页）
+        since: 只返回 seq 大于该值的记录（轮询新记录）
+        created_after / created_before: createdAt 的 ISO 时间范围（含边界）
+        """
+        clauses = []
+        params: list = []
+        if cursor is not None:
+            clauses.append("seq < ?")
+            params.append(cursor)
+        if since is not None:
+            clauses.append("seq > ?")
+            params.append(since)
+        if style:
+            clauses.append("style = ?")
+            params.append(style)
+        if provider:
+            clauses.append("provider = ?")
+            params.append(provider)
+        if is_mock is not None:
+            clauses.append("is_mock = ?")
+            params.append(int(is_mock))
+        if created_after:
+            clauses.append("created_at >= ?")
+            params.append(created_after)
+        if created_before:
+            clauses.append("created_at <= ?")
+            params.append(created_before)
+
+        def matches(seq: int, record: MemeRecord) -> bool:
+            return (
+                (cursor is None or seq < cursor)
+                and (since is None or seq > since)
+                and (not style or record.style == style)
+                and (not provider or record.provider == provider)
+                and (is_mock is None or record.isMock == is_mock)
+                and (not created_after or record.createdAt >= created_after)
+                and (not created_before or record.createdAt <= created_before)
+            )
+
+        sql = "SELECT seq, id, data FROM memes"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY seq DESC LIMIT ?"
+
+        with self._lock:
+            pending = [item for item in self._pending_newest_first() if matches(*item)]
+            pending_ids = set(self._pending)
+            # 多取一条判断是否还有下一页；被缓冲中新版本覆盖的旧行需要跳过
+            params.append(limit + 1 + len(pending_ids))
+            rows = self._conn.execute(sql, params).fetchall()
+
+        merged = pending + [
+            (seq, MemeRecord(**json.loads(data)))
+            for seq, meme_id, data in rows
+            if meme_id not in pending_ids
+        ]
+        merged.sort(key=lambda item: item[0], reverse=True)
+        return merged[:limit], len(merged) > limit
 
     def delete(self, meme_id: str) -> bool:
         """删除记录"""
-        records = self.get_all()
-        original_count = len(records)
-        records = [r for r in records if r.id != meme_id]
-        if len(records) < original_count:
-            with open(self.storage_path, "w", encoding="utf-8") as f:
-                json.dump([r.dict() for r in records], f, ensure_ascii=False, indent=2)
-            return True
-        return False
+        with self._lock:
+            buffered = self._pending.pop(meme_id, None) is not None
+            cursor = self._conn.execute("DELETE FROM memes WHERE id = ?", (meme_id,))
+            self._conn.commit()
+        return buffered or cursor.rowcount > 0
+
+    def referenced_image_names(self, filenames: List[str]) -> Set[str]:
+        """这些图片文件名中仍被记录引用的部分（上传目录垃圾回收按批查询，走 image_name 索引）"""
+        names = list(dict.fromkeys(filenames))
+        referenced: Set[str] = set()
+        with self._lock:
+            pending = {_image_name(record.imageUrl) for _, record in self._pending.values()}
+            for start in range(0, len(names), 500):
+                chunk = names[start : start + 500]
+                rows = self._conn.execute(
+                    "SELECT DISTINCT image_name FROM memes WHERE image_name IN "
+                    f"({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                referenced.update(row[0] for row in rows)
+        referenced.update(name for name in names if name in pending)
+        return referenced
+
+    def delete_by_image_names(self, filenames: List[str]) -> int:
+        """删除引用了这些图片文件名的记录，返回删除条数"""
+        names = list(dict.fromkeys(filenames))
+        if not names:
+            return 0
+        deleted = 0
+        with self._lock:
+            self._flush_locked()
+            with self._conn:
+                for start in range(0, len(names), 500):
+                    chunk = names[start : start + 500]
+                    deleted += self._conn.execute(
+                        "DELETE FROM memes WHERE image_name IN "
+                        f"({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).rowcount
+        return deleted
 
     def get_by_id(self, meme_id: str) -> Optional[MemeRecord]:
         """根据ID获取记录"""
-        records = self.get_all()
-        for record in records:
-            if record.id == meme_id:
-                return record
-        return None
+        with self._lock:
+            if meme_id in self._pending:
+                return self._pending[meme_id][1]
+            row = self._conn.execute(
+                "SELECT data FROM memes WHERE id = ?", (meme_id,)
+            ).fetchone()
+        return MemeRecord(**json.loads(row[0])) if row else None
+
+    def close(self) -> None:
+        """写入未落盘记录并关闭连接"""
+        with self._cond:
+            if self._closed:
+                return
+            self._flush_locked()
+            self._closed = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self._conn.close()
 
 
 # 全局存储实例
@@ -1,30 +1,61 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field, constr, conint
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, constr, conint, conlist
+from typing import Literal, Optional
+import asyncio
+import json
+import math
+import time
 import uuid
 import os
 from datetime import datetime
-import shutil
+from functools import partial
 
 try:
     from app.services.prompt_optimizer import prompt_optimizer
-    from app.services.image_generator import image_generator
+    from app.services.image_generator import image_generator, ProgressCallback
+    from app.services.provider_limiter import ProviderBusyError
+    from app.services.image_artifact import ImageArtifact
+    from app.services.image_encoder import image_encoder
+    from app.services.thumbnail_service import thumbnail_service
+    from app.services.upload_gc import upload_gc
+    from app.services.image_hash import compute_hashes, output_hashes, template_hashes
     from app.services.image_processor import image_processor
     from app.services.caption_generator import caption_generator
     from app.services.template_library import template_library
+    from app.services.template_search import template_search
     from app.services.image_upscaler import image_upscaler
+    from app.services.variant_engine import variant_engine
+    from app.services.request_coalescer import request_coalescer
+    from app.services.result_cache import generation_cache
+    from app.services.job_manager import job_manager, JobQueueFullError
+    from app.services.batch_scheduler import batch_scheduler
     from app.models.meme import MemeRecord, meme_storage
 except ImportError:
     from services.prompt_optimizer import prompt_optimizer
-    from services.image_generator import image_generator
+    from services.image_generator import image_generator, ProgressCallback
+    from services.provider_limiter import ProviderBusyError
+    from services.image_artifact import ImageArtifact
+    from services.image_encoder import image_encoder
+    from services.thumbnail_service import thumbnail_service
+    from services.upload_gc import upload_gc
+    from services.image_hash import compute_hashes, output_hashes, template_hashes
     from services.image_processor import image_processor
     from services.caption_generator import caption_generator
     from services.template_library import template_library
+    from services.template_search import template_search
     from services.image_upscaler import image_upscaler
+    from services.variant_engine import variant_engine
+    from services.request_coalescer import request_coalescer
+    from services.result_cache import generation_cache
+    from services.job_manager import job_manager, JobQueueFullError
+    from services.batch_scheduler import batch_scheduler
     from models.meme import MemeRecord, meme_storage
 
 router = APIRouter()
 
+OutputFormat = Literal["auto", "png", "webp", "webp_lossless", "avif"]
+
 image_upscaler.set_upload_dir(image_generator.upload_dir)
 
 
@@ -37,6 +68,13 @@ class GenerateRequest(BaseModel):
     memeMode: bool = False
     addTextBubble: bool = True
     text: Optional[constr(max_length=60)] = None
+    seed: Optional[int] = None
+    # False 时跳过结果缓存与请求合并，强制重新生成
+    useCache: bool = True
+    # 流式返回：每个变体完成即推送一帧，最后推送汇总帧
+    stream: Optional[Literal["ndjson", "sse"]] = None
+    # 输出格式，未指定时使用服务端默认（OUTPUT_IMAGE_FORMAT）
+    outputFormat: Optional[OutputFormat] = None
 
 
 class GeneratedImage(BaseModel):
@@ -46,6 +84,8 @@ class GeneratedImage(BaseModel):
     provider: Optional[str] = None
     isMock: Optional[bool] = None
     variantIndex: int = 0
+    cached: Optional[bool] = None
+    hedged: Optional[bool] = None
 
 
 class GenerateResponse(BaseModel):
@@ -57,6 +97,7 @@ class GenerateResponse(BaseModel):
     provider: Optional[str] = None
     isMock: Optional[bool] = None
     images: Optional[list[GeneratedImage]] = None
+    errors: Optional[list[str]] = None
     error: Optional[str] = None
 
 
@@ -67,78 +108,204 @@ class OptimizePromptRequest(BaseModel):
     memeMode: bool = False
 
 
-@router.post("/generate")
-async def generate_meme(request: GenerateRequest) -> GenerateResponse:
+_background_tasks: set = set()
+
+
+def _run_in_background(coro) -> None:
+    # 持有任务引用，避免未完成的后台任务被回收
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _to_static_url(path: str) -> str:
+    relative = os.path.relpath(path, image_generator.static_dir)
+    return f"/static/{relative.replace(os.sep, '/')}"
+
+
+def _resolve_static_path(url: str) -> Optional[str]:
+    """把 /static/... URL 映射回磁盘路径（仅限 static 目录内）"""
+    relative = url.split("?", 1)[0]
+    marker = relative.find("/static/")
+    if marker >= 0:
+        relative = relative[marker + len("/static/"):]
+    else:
+        relative = os.path.join("uploads", os.path.basename(relative))
+    static_dir = os.path.abspath(image_generator.static_dir)
+    path = os.path.abspath(os.path.join(static_dir, relative))
+    if not path.startswith(static_dir + os.sep):
+        return None
+    return path
+
+
+def _render_output(
+    artifact: ImageArtifact, text: Optional[str] = None, output_format: Optional[str] = None
+) -> str:
+    """在内存中完成后处理，最终输出只编码一次（无改动且格式满足时直接复用已有编码）"""
+    if text:
+        image = image_processor.draw_text_bubble(artifact.to_image(), text)
+        return ImageArtifact(image=image).save(
+            image_generator.upload_dir, prefix="processed", fmt=output_format
+        )
+    if artifact.shared:
+        return artifact.save_shared(image_generator.upload_dir, fmt=output_format)
+    return artifact.save(image_generator.upload_dir, fmt=output_format)
+
+
+async def _generate_variant(
+    request: GenerateRequest,
+    optimized_prompt: str,
+    template: Optional[dict],
+    idx: int,
+    num_variants: int,
+    emit: Optional[ProgressCallback] = None,
+    preferred_provider: Optional[str] = None,
+) -> GeneratedImage:
+    def _emit(stage: str, data: Optional[dict] = None):
+        if emit:
+            emit(stage, {"variantIndex": idx, **(data or {})})
+
+    # 指定 seed 时每个变体用 seed + idx 并传给提供方；未指定时由提供方随机，
+    # 变体序号单独进入缓存 / 合并键，保证同一请求的多个变体互不相同
+    seed = request.seed + idx if request.seed is not None else None
+
+    async def _generate(on_event: ProgressCallback = _emit):
+        if not template:
+            return await image_generator.generate(
+                optimized_prompt,
+                request.style,
+                seed=seed,
+                use_cache=request.useCache,
+                on_event=on_event,
+                preferred_provider=preferred_provider,
+                variant=idx,
+            )
+        return await image_generator.generate_from_template(
+            optimized_prompt,
+            template["path"],
+            style=request.style,
+            template_id=template["id"],
+            seed=seed,
+            use_cache=request.useCache,
+            on_event=on_event,
+            variant=idx,
+        )
+
+    if request.useCache:
+        # 相同参数的并发请求合并为一次提供方调用，阶段事件转发给每个合并进来的请求
+        coalesce_key = request_coalescer.build_key(
+            prompt=optimized_prompt,
+            style=request.style,
+            provider=image_generator.get_provider_signature(preferred_provider),
+            width=512,
+            height=512,
+            template=template["id"] if template else None,
+            seed=seed,
+            variant=idx,
+        )
+        image_result = await request_coalescer.run(coalesce_key, _generate, on_event=_emit)
+    else:
+        image_result = await _generate()
+
+    print(
+        f"🧭 Variant {idx + 1}/{num_variants} provider: {image_result.provider}, mock: {image_result.is_mock}, cached: {image_result.cached}"
+    )
+
+    # 3. 图片后处理 + 落盘（放到线程池避免阻塞事件循环）
+    # image_result 可能被合并的请求共享，不做原地修改
+    bubble_text = request.text if request.addTextBubble else None
+    image_path = await asyncio.to_thread(
+        _render_output, image_result.artifact, bubble_text, request.outputFormat
+    )
+    if bubble_text:
+        _emit("post_processed", {"textBubble": True})
+
+    # 4. 生成访问URL（缩略图与感知哈希在后台计算，不阻塞响应）
+    image_url = _to_static_url(image_path)
+    if thumbnail_service.eager:
+        _run_in_background(asyncio.to_thread(thumbnail_service.ensure_all, image_path))
+    _run_in_background(
+        asyncio.to_thread(output_hashes.update, os.path.basename(image_path), image_path)
+    )
+
+    # 5. 保存记录
+    created_at = datetime.utcnow().isoformat()
+    record = MemeRecord(
+        id=str(uuid.uuid4()),
+        prompt=request.prompt,
+        optimizedPrompt=optimized_prompt,
+        style=request.style,
+        imageUrl=image_url,
+        createdAt=created_at,
+        provider=image_result.provider,
+        isMock=image_result.is_mock,
+        styleStrength=request.styleStrength,
+    )
+    meme_storage.save(record)
+
+    image = GeneratedImage(
+        id=record.id,
+        imageUrl=image_url,
+        createdAt=created_at,
+        provider=image_result.provider,
+        isMock=image_result.is_mock,
+        variantIndex=idx,
+        cached=image_result.cached,
+        hedged=image_result.hedged,
+    )
+    _emit("variant_done", {"image": image.dict()})
+    return image
+
+
+async def _run_generation(
+    request: GenerateRequest,
+    emit: Optional[ProgressCallback] = None,
+    preferred_provider: Optional[str] = None,
+) -> GenerateResponse:
     try:
         # 1. 优化提示词
         optimized_prompt = await prompt_optimizer.optimize(
             request.prompt, request.style, request.styleStrength, request.memeMode
         )
+        if emit:
+            emit("prompt_optimized", {"optimizedPrompt": optimized_prompt})
 
-        # 2. 生成图片（支持模板和多变体）
+        # 2. 并发生成图片（支持模板和多变体）
         num_variants = max(1, min(6, int(request.numVariants)))
-        images: list[GeneratedImage] = []
-
-        for idx in range(num_variants):
-            if request.templateId:
-                template = template_library.get_template(request.templateId)
-                if not template:
-                    raise Exception("Template not found")
-                source_path = template["path"]
-                filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-                target_path = os.path.join(
-                    os.path.dirname(source_path).replace("templates", "uploads"),
-                    filename,
-                )
-                shutil.copyfile(source_path, target_path)
+        template = None
+        if request.templateId:
+            template = template_library.get_template(request.templateId)
+            if not template:
+                raise Exception("Template not found")
+
+        outcomes = await variant_engine.run(
+            num_variants,
+            lambda idx: _generate_variant(
+                request,
+                optimized_prompt,
+                template,
+                idx,
+                num_variants,
+                emit,
+                preferred_provider,
+            ),
+        )
 
-                image_result = await image_generator.generate_from_template(
-                    optimized_prompt, target_path, style=request.style
-                )
+        images: list[GeneratedImage] = []
+        errors: list[str] = []
+        failures: list[BaseException] = []
+        for idx, outcome in enumerate(outcomes):
+            if isinstance(outcome, BaseException):
+                print(f"⚠️ Variant {idx + 1}/{num_variants} failed: {outcome}")
+                errors.append(f"variant {idx}: {outcome}")
+                failures.append(outcome)
+                if emit:
+                    emit("variant_failed", {"variantIndex": idx, "error": str(outcome)})
             else:
-                image_result = await image_generator.generate(
-                    optimized_prompt, request.style
-                )
-
-            print(
-                f"🧭 Variant {idx + 1}/{num_variants} provider: {image_result.provider}, mock: {image_result.is_mock}"
-            )
+                images.append(outcome)
 
-            # 3. 图片后处理（添加文字气泡）
-            if request.addTextBubble and request.text:
-                image_result.path = image_processor.add_text_bubble(
-                    image_result.path, request.text
-                )
-
-            # 4. 生成访问URL
-            filename = os.path.basename(image_result.path)
-            image_url = f"/static/uploads/{filename}"
-
-            # 5. 保存记录
-            created_at = datetime.utcnow().isoformat()
-            record = MemeRecord(
-                id=str(uuid.uuid4()),
-                prompt=request.prompt,
-                optimizedPrompt=optimized_prompt,
-                style=request.style,
-                imageUrl=image_url,
-                createdAt=created_at,
-                provider=image_result.provider,
-                isMock=image_result.is_mock,
-                styleStrength=request.styleStrength,
-            )
-            meme_storage.save(record)
-
-            images.append(
-                GeneratedImage(
-                    id=record.id,
-                    imageUrl=image_url,
-                    createdAt=created_at,
-                    provider=image_result.provider,
-                    isMock=image_result.is_mock,
-                    variantIndex=idx,
-                )
-            )
+        if not images:
+            raise failures[0]
 
         primary = images[0]
         return GenerateResponse(
@@ -150,8 +317,12 @@ async def generate_meme(request: GenerateRequest) -> GenerateResponse:
             provider=primary.provider,
             isMock=primary.isMock,
             images=images,
+            errors=errors or None,
         )
 
+    except ProviderBusyError:
+        # 提供方排队已满：交给调用方返回 429，而不是降级到 mock
+        raise
     except Exception as e:
         return GenerateResponse(
             success=False,
@@ -165,6 +336,221 @@ async def generate_meme(request: GenerateRequest) -> GenerateResponse:
         )
 
 
+def _format_stream_frame(fmt: str, frame_type: str, payload: dict) -> str:
+    body = json.dumps({"type": frame_type, **payload}, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {frame_type}\ndata: {body}\n\n"
+    return f"{body}\n"
+
+
+def _stream_generation(request: GenerateRequest) -> StreamingResponse:
+    fmt = request.stream or "ndjson"
+    frames: asyncio.Queue = asyncio.Queue()
+
+    def _emit(stage: str, data: dict):
+        if stage == "variant_done":
+            frames.put_nowait(data["image"])
+
+    async def _frames():
+        task = asyncio.create_task(_run_generation(request, _emit))
+        # 所有 variant_done 事件都先于任务结束入队，None 作为结束标记
+        task.add_done_callback(lambda _: frames.put_nowait(None))
+        try:
+            while True:
+                image = await frames.get()
+                if image is None:
+                    break
+                yield _format_stream_frame(fmt, "image", {"image": image})
+            try:
+                response = task.result()
+            except ProviderBusyError as e:
+                response = GenerateResponse(
+                    success=False, imageUrl="", optimizedPrompt="", error=str(e)
+                )
+            yield _format_stream_frame(fmt, "summary", {"response": response.dict()})
+        finally:
+            if not task.done():
+                task.cancel()
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        _frames(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/generate")
+async def generate_meme(request: GenerateRequest) -> GenerateResponse:
+    if request.stream:
+        return _stream_generation(request)
+    try:
+        return await _run_generation(request)
+    except ProviderBusyError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
+
+
+class BatchEntry(BaseModel):
+    prompt: constr(strip_whitespace=True, min_length=1, max_length=200)
+    style: str = "cartoon"
+    styleStrength: conint(ge=1, le=3) = 2
+    templateId: Optional[str] = None
+    memeMode: bool = False
+    addTextBubble: bool = True
+    text: Optional[constr(max_length=60)] = None
+    outputFormat: Optional[OutputFormat] = None
+
+
+class BatchGenerateRequest(BaseModel):
+    entries: conlist(BatchEntry, min_length=1, max_length=500)
+    useCache: bool = True
+    stream: Literal["ndjson", "sse"] = "ndjson"
+
+
+@router.post("/generate/batch")
+async def generate_batch(request: BatchGenerateRequest):
+    """
+    批量生成：相同条目去重，经公平调度器限流执行，按完成顺序逐条推送结果
+    """
+    fmt = request.stream
+    batch_id = uuid.uuid4().hex
+
+    # 去重：相同参数的条目只生成一次，结果帧中列出所有对应下标
+    unique: dict[str, tuple[BatchEntry, list[int]]] = {}
+    for index, entry in enumerate(request.entries):
+        key = json.dumps(entry.dict(), sort_keys=True, ensure_ascii=False)
+        if key in unique:
+            unique[key][1].append(index)
+        else:
+            unique[key] = (entry, [index])
+
+    # 按条目轮流分配首选提供方，把负载摊到所有可用提供方上
+    providers = image_generator.get_available_providers()
+
+    async def _collect(future: asyncio.Future, indexes: list[int]):
+        try:
+            return indexes, await future
+        except Exception as e:
+            return indexes, GenerateResponse(
+                success=False, imageUrl="", optimizedPrompt="", error=str(e)
+            )
+
+    async def _frames():
+        started = time.time()
+        pending = []
+        for slot, (entry, indexes) in enumerate(unique.values()):
+            generate_request = GenerateRequest(
+                **entry.dict(), numVariants=1, useCache=request.useCache
+            )
+            preferred = providers[slot % len(providers)] if providers else None
+            future = batch_scheduler.submit(
+                batch_id,
+                partial(_run_generation, generate_request, None, preferred),
+            )
+            pending.append(asyncio.ensure_future(_collect(future, indexes)))
+
+        succeeded = 0
+        failed = 0
+        try:
+            yield _format_stream_frame(
+                fmt,
+                "accepted",
+                {"batchId": batch_id, "total": len(request.entries), "unique": len(unique)},
+            )
+            for next_done in asyncio.as_completed(pending):
+                indexes, response = await next_done
+                if response.success:
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield _format_stream_frame(
+                    fmt,
+                    "result",
+                    {"indexes": indexes, "success": response.success, "response": response.dict()},
+                )
+        finally:
+            # 客户端断开时取消尚未开始的条目
+            batch_scheduler.cancel_batch(batch_id)
+            for task in pending:
+                task.cancel()
+
+        yield _format_stream_frame(
+            fmt,
+            "summary",
+            {
+                "batchId": batch_id,
+                "total": len(request.entries),
+                "unique": len(unique),
+                "succeeded": succeeded,
+                "failed": failed,
+                "durationMs": int((time.time() - started) * 1000),
+            },
+        )
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        _frames(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/generate/batch/status")
+async def get_batch_status() -> dict:
+    return {"scheduler": batch_scheduler.get_status()}
+
+
+@router.post("/generate/jobs")
+async def create_generate_job(request: GenerateRequest) -> dict:
+    async def _runner(emit: ProgressCallback) -> dict:
+        response = await _run_generation(request, emit)
+        if not response.success:
+            raise Exception(response.error or "Generation failed")
+        return response.dict()
+
+    try:
+        job = job_manager.submit(_runner)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"jobId": job.id, "status": job.status}
+
+
+@router.get("/generate/jobs/{job_id}")
+async def get_generate_job(job_id: str) -> dict:
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+def _format_sse(event: Optional[dict]) -> str:
+    if event is None:
+        return ": keep-alive\n\n"
+    payload = json.dumps(event, ensure_ascii=False)
+    return f"id: {event['seq']}\nevent: {event['stage']}\ndata: {payload}\n\n"
+
+
+@router.get("/generate/jobs/{job_id}/events")
+async def stream_generate_job(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def _events():
+        async for event in job_manager.stream_events(job):
+            yield _format_sse(event)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/optimize-prompt")
 async def optimize_prompt(request: OptimizePromptRequest) -> dict:
     try:
@@ -180,12 +566,142 @@ async def optimize_prompt(request: OptimizePromptRequest) -> dict:
 async def get_providers() -> dict:
     return {
         "providers": image_generator.get_provider_status(),
+        "health": image_generator.get_provider_health(),
+    }
+
+
+@router.get("/cache")
+async def get_cache_status() -> dict:
+    return {"cache": generation_cache.get_status()}
+
+
+@router.get("/encoder")
+async def get_encoder_status() -> dict:
+    return {"encoder": image_encoder.get_status()}
+
+
+@router.get("/uploads/gc")
+async def get_upload_gc_status() -> dict:
+    return {"gc": upload_gc.get_status()}
+
+
+@router.post("/uploads/gc")
+async def run_upload_gc() -> dict:
+    """立即执行一轮上传目录回收"""
+    result = await upload_gc.run_once()
+    return {"result": result, "gc": upload_gc.get_status()}
+
+
+def _similarity_query(
+    template_id: Optional[str], image_url: Optional[str]
+) -> tuple:
+    """查询图片的感知哈希，返回 (哈希, 模板 id, 上传文件名)（阻塞调用）"""
+    if template_id:
+        template = template_library.get_template(template_id)
+        if not template:
+            raise HTTPException(status_code=404, detail="Template not found")
+        template_library.ensure_hashes()
+        return template_hashes.update(template_id, template["path"]), template_id, None
+    if not image_url:
+        raise HTTPException(status_code=400, detail="templateId or imageUrl is required")
+    source_path = thumbnail_service.resolve_source(image_url)
+    if source_path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if os.path.dirname(source_path) == os.path.abspath(image_generator.upload_dir):
+        filename = os.path.basename(source_path)
+        return output_hashes.update(filename, source_path), None, filename
+    return compute_hashes(source_path), None, None
+
+
+@router.get("/templates/similar")
+async def get_similar_templates(
+    templateId: Optional[str] = None,
+    imageUrl: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    maxDistance: Optional[int] = Query(None, ge=0, le=64),
+) -> dict:
+    """按感知哈希查找与模板 / 图片相似的模板（BK 树查询，不逐个比对文件）"""
+    hashes, template_id, _ = await asyncio.to_thread(_similarity_query, templateId, imageUrl)
+    items = await asyncio.to_thread(
+        template_library.find_similar, hashes, template_id, limit, maxDistance
+    )
+    for item in items:
+        item.update(thumbnail_service.urls_for(item["previewUrl"]))
+    return {"templates": items}
+
+
+@router.get("/uploads/similar")
+async def get_similar_outputs(
+    imageUrl: str,
+    limit: int = Query(10, ge=1, le=100),
+    maxDistance: Optional[int] = Query(None, ge=0, le=64),
+) -> dict:
+    """查找与某张图片相似的生成结果"""
+    hashes, _, filename = await asyncio.to_thread(_similarity_query, None, imageUrl)
+    matches = await asyncio.to_thread(output_hashes.search, hashes, maxDistance, filename, limit)
+    return {
+        "images": [
+            {"imageUrl": f"/static/uploads/{key}", "distance": distance}
+            for distance, key in matches
+        ]
     }
 
 
+# 预序列化的模板列表：(模板索引版本, 已生成的模板缩略图数) → JSON 字节
+# 只随模板与模板缩略图变化失效，生成结果的缩略图不影响
+_templates_body: Optional[tuple] = None
+
+
+def _render_templates_body() -> bytes:
+    templates = template_library.list_templates()
+    for item in templates:
+        item.update(thumbnail_service.urls_for(item["previewUrl"]))
+    return json.dumps({"templates": templates}, ensure_ascii=False).encode("utf-8")
+
+
 @router.get("/templates")
-async def get_templates() -> dict:
-    return {"templates": template_library.list_templates()}
+async def get_templates() -> Response:
+    global _templates_body
+    key = (template_library.get_version(), thumbnail_service.template_generated)
+    if _templates_body is None or _templates_body[0] != key:
+        # 重建时逐个 stat 缩略图，放到线程池
+        _templates_body = (key, await asyncio.to_thread(_render_templates_body))
+    return Response(content=_templates_body[1], media_type="application/json")
+
+
+@router.get("/templates/search")
+async def search_templates(
+    q: constr(strip_whitespace=True, min_length=1, max_length=64),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+) -> dict:
+    """模糊搜索模板（名称 / 拼音 / 首字母 / 来源，按相关度排序并分页）"""
+    total, items = await asyncio.to_thread(template_search.search, q, limit, offset)
+    for item in items:
+        item.update(thumbnail_service.urls_for(item["previewUrl"]))
+    next_offset = offset + len(items)
+    return {
+        "query": q,
+        "total": total,
+        "offset": offset,
+        "nextOffset": next_offset if next_offset < total else None,
+        "templates": items,
+    }
+
+
+@router.get("/thumbnail")
+async def get_thumbnail(src: str, w: int) -> FileResponse:
+    """按需生成并返回缩略图（之后同一缩略图直接走静态文件）"""
+    source_path = thumbnail_service.resolve_source(src)
+    if not source_path:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if w not in thumbnail_service.widths:
+        raise HTTPException(status_code=400, detail="Unsupported thumbnail width")
+    try:
+        thumb_path = await asyncio.to_thread(thumbnail_service.ensure, source_path, w)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Thumbnail generation failed: {e}")
+    return FileResponse(thumb_path, headers={"Cache-Control": "public, max-age=86400"})
 
 
 class CaptionRequest(BaseModel):
@@ -196,7 +712,7 @@ class CaptionRequest(BaseModel):
 
 @router.post("/caption")
 async def generate_caption(request: CaptionRequest) -> dict:
-    caption = caption_generator.generate(
+    caption = await caption_generator.generate(
         prompt=request.prompt,
         style=request.style,
         meme_mode=request.memeMode,
@@ -213,7 +729,7 @@ class CaptionBatchRequest(BaseModel):
 
 @router.post("/caption/batch")
 async def generate_caption_batch(request: CaptionBatchRequest) -> dict:
-    captions = caption_generator.generate_batch(
+    captions = await caption_generator.generate_batch(
         prompt=request.prompt,
         style=request.style,
         meme_mode=request.memeMode,
@@ -234,12 +750,14 @@ async def sync_templates(request: TemplateSyncRequest) -> dict:
     source = (request.source or "imgflip").strip().lower()
     try:
         if source == "imgflip":
-            result = template_library.sync_imgflip(limit=int(request.limit), force=request.force)
+            result = await template_library.sync_imgflip(
+                limit=int(request.limit), force=request.force
+            )
         elif source == "urls":
             urls = request.urls or []
             if not urls:
                 raise HTTPException(status_code=400, detail="urls is required when source=urls")
-            result = template_library.sync_urls(urls=urls, force=request.force)
+            result = await template_library.sync_urls(urls=urls, force=request.force)
         else:
             raise HTTPException(status_code=400, detail="Unsupported source")
     except HTTPException:
@@ -256,6 +774,7 @@ async def sync_templates(request: TemplateSyncRequest) -> dict:
 
 class UpscaleRequest(BaseModel):
     imageUrl: constr(strip_whitespace=True, min_length=1)
+    outputFormat: Optional[OutputFormat] = None
 
 
 @router.post("/upscale")
@@ -263,13 +782,12 @@ async def upscale_image(request: UpscaleRequest) -> dict:
     if not image_upscaler.is_available():
         raise HTTPException(status_code=400, detail="CLIPDROP_API_KEY not configured")
 
-    filename = os.path.basename(request.imageUrl)
-    source_path = os.path.join(image_generator.upload_dir, filename)
-    if not os.path.exists(source_path):
+    source_path = _resolve_static_path(request.imageUrl)
+    if not source_path or not os.path.isfile(source_path):
         raise HTTPException(status_code=404, detail="Image not found")
 
     try:
-        upscaled_path = await image_upscaler.upscale(source_path)
+        upscaled_path = await image_upscaler.upscale(source_path, request.outputFormat)
         upscaled_filename = os.path.basename(upscaled_path)
         return {"imageUrl": f"/static/uploads/{upscaled_filename}"}
     except Exception as e:
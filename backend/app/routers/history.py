@@ -1,22 +1,52 @@
-from fastapi import APIRouter
-from typing import List
+from fastapi import APIRouter, Query, Response
+from typing import List, Optional
 
 try:
     from app.models.meme import MemeRecord, meme_storage
+    from app.services.thumbnail_service import thumbnail_service
 except ImportError:
     from models.meme import MemeRecord, meme_storage
+    from services.thumbnail_service import thumbnail_service
 
 router = APIRouter()
 
 
+# 普通 def：FastAPI 放进线程池执行，阻塞的 SQLite 查询与缩略图检查不占用事件循环
 @router.get("/history")
-async def get_history() -> List[dict]:
-    records = meme_storage.get_all()
-    return [record.dict() for record in records]
+def get_history(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[int] = Query(None, description="上一页最后一条记录的 cursor，返回更早的记录"),
+    since: Optional[int] = Query(None, description="只返回 cursor 大于该值的新记录（轮询用）"),
+    style: Optional[str] = None,
+    provider: Optional[str] = None,
+    isMock: Optional[bool] = None,
+    createdAfter: Optional[str] = Query(None, description="ISO 时间，含边界"),
+    createdBefore: Optional[str] = Query(None, description="ISO 时间，含边界"),
+) -> List[dict]:
+    rows, has_more = meme_storage.query(
+        limit=limit,
+        cursor=cursor,
+        since=since,
+        style=style,
+        provider=provider,
+        is_mock=isMock,
+        created_after=createdAfter,
+        created_before=createdBefore,
+    )
+    # 保持列表响应格式，分页信息放在响应头和每条记录的 cursor 字段
+    if has_more and rows:
+        response.headers["X-Next-Cursor"] = str(rows[-1][0])
+    if rows:
+        response.headers["X-Latest-Cursor"] = str(rows[0][0])
+    return [
+        {**record.dict(), "cursor": seq, **thumbnail_service.urls_for(record.imageUrl)}
+        for seq, record in rows
+    ]
 
 
 @router.delete("/history/{meme_id}")
-async def delete_history(meme_id: str):
+def delete_history(meme_id: str):
     success = meme_storage.delete(meme_id)
     if not success:
         return {"success": False, "message": "记录不存在"}
@@ -0,0 +1,79 @@
+"""
+批量生成公平调度器
+- 全局并发上限，所有批次共享
+- 各批次按轮询方式获得执行槽位，大批次不会饿死小批次
+- 单个任务失败只影响自身的 Future
+"""
+
+import asyncio
+import os
+from collections import OrderedDict, deque
+from functools import partial
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+TaskFactory = Callable[[], Awaitable[Any]]
+
+
+class FairScheduler:
+    def __init__(self, max_concurrency: int = 0):
+        self.max_concurrency = max(
+            1, int(max_concurrency or os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+        )
+        self.running = 0
+        self._queues: "OrderedDict[str, Deque[Tuple[TaskFactory, asyncio.Future]]]" = OrderedDict()
+        print(f"🗂️ FairScheduler initialized (max_concurrency={self.max_concurrency})")
+
+    def submit(self, batch_id: str, factory: TaskFactory) -> asyncio.Future:
+        """把任务加入指定批次的队列，返回任务结果的 Future"""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(batch_id, deque()).append((factory, future))
+        self._dispatch()
+        return future
+
+    def cancel_batch(self, batch_id: str) -> int:
+        """取消某批次尚未开始的任务，返回取消数量"""
+        queue = self._queues.pop(batch_id, None)
+        if not queue:
+            return 0
+        for _, future in queue:
+            future.cancel()
+        return len(queue)
+
+    def _dispatch(self) -> None:
+        while self.running < self.max_concurrency and self._queues:
+            batch_id, queue = next(iter(self._queues.items()))
+            factory, future = queue.popleft()
+            # 轮询：当前批次取走一个任务后排到队尾
+            if queue:
+                self._queues.move_to_end(batch_id)
+            else:
+                del self._queues[batch_id]
+            if future.done():
+                continue
+            self.running += 1
+            task = asyncio.ensure_future(factory())
+            task.add_done_callback(partial(self._on_done, future))
+
+    def _on_done(self, future: asyncio.Future, task: asyncio.Future) -> None:
+        self.running -= 1
+        if not future.done():
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        elif not task.cancelled():
+            task.exception()
+        self._dispatch()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "maxConcurrency": self.max_concurrency,
+            "running": self.running,
+            "queued": {batch_id: len(queue) for batch_id, queue in self._queues.items()},
+        }
+
+
+# 全局实例
+batch_scheduler = FairScheduler()
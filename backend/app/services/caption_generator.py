@@ -6,9 +6,13 @@
 
 import os
 import random
-import requests
 import re
 
+try:
+    from app.services.http_client import http_client
+except ImportError:
+    from services.http_client import http_client
+
 
 class CaptionGenerator:
     def __init__(self):
@@ -58,10 +62,12 @@ class CaptionGenerator:
         else:
             print("📝 Caption LLM disabled (CAPTION_LLM_URL not set)")
 
-    def generate(self, prompt: str, style: str = "cartoon", meme_mode: bool = False) -> str:
+    async def generate(
+        self, prompt: str, style: str = "cartoon", meme_mode: bool = False
+    ) -> str:
         if self._llm_enabled():
             try:
-                captions = self._call_llm(prompt, style, meme_mode, count=1)
+                captions = await self._call_llm(prompt, style, meme_mode, count=1)
                 if captions:
                     return captions[0]
             except Exception as e:
@@ -84,13 +90,13 @@ class CaptionGenerator:
 
         return "，".join(parts)
 
-    def generate_batch(
+    async def generate_batch(
         self, prompt: str, style: str = "cartoon", meme_mode: bool = False, count: int = 3
     ) -> list[str]:
         count = max(1, min(6, int(count)))
         if self._llm_enabled():
             try:
-                captions = self._call_llm(prompt, style, meme_mode, count=count)
+                captions = await self._call_llm(prompt, style, meme_mode, count=count)
                 if captions:
                     return captions[:count]
             except Exception as e:
@@ -101,7 +107,7 @@ class CaptionGenerator:
         attempts = 0
 
         while len(results) < count and attempts < count * 4:
-            caption = self.generate(prompt, style, meme_mode)
+            caption = await self.generate(prompt, style, meme_mode)
             attempts += 1
             if caption in seen:
                 continue
@@ -113,7 +119,7 @@ class CaptionGenerator:
     def _llm_enabled(self) -> bool:
         return bool(self.llm_url)
 
-    def _call_llm(
+    async def _call_llm(
         self, prompt: str, style: str, meme_mode: bool, count: int = 1
     ) -> list[str]:
         count = max(1, min(6, int(count)))
@@ -142,7 +148,7 @@ class CaptionGenerator:
             "max_tokens": 160,
         }
 
-        response = requests.post(
+        response = await http_client.post(
             self.llm_url, headers=headers, json=payload, timeout=self.llm_timeout
         )
         if response.status_code >= 400:
@@ -0,0 +1,104 @@
+"""
+字体注册表
+- 进程内共享：字体路径只查找一次，已加载的字体按 (路径, 字号) 做 LRU 缓存
+- 解析 NotoSansCJK 之类的大 TTC 文件开销很大，文字气泡每次自适应字号都会用到多个字号
+- 启动时预加载文字气泡会用到的字号
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from PIL import ImageFont
+
+# 按优先级排列的候选字体（MEME_FONT_PATH 优先）
+FONT_PATHS = [
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/Hiragino Sans GB.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+    "/System/Library/Fonts/Helvetica.ttc",
+    "/System/Library/Fonts/SF Pro.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+]
+
+_UNRESOLVED = object()
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+class FontRegistry:
+    def __init__(self):
+        self.max_entries = max(1, int(os.getenv("FONT_CACHE_SIZE", "32")))
+        self.preload_enabled = _env_flag("FONT_PRELOAD", True)
+        self._path = _UNRESOLVED
+        self._fonts: "OrderedDict[tuple, ImageFont.ImageFont]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    @property
+    def path(self) -> Optional[str]:
+        """第一个存在的字体文件（只查找一次）；都不存在时为 None，使用 Pillow 默认字体"""
+        if self._path is _UNRESOLVED:
+            candidates = list(FONT_PATHS)
+            env_font = os.getenv("MEME_FONT_PATH")
+            if env_font:
+                candidates.insert(0, env_font)
+            self._path = next((path for path in candidates if os.path.exists(path)), None)
+        return self._path
+
+    def _load(self, path: Optional[str], size: int):
+        if path:
+            try:
+                return ImageFont.truetype(path, size)
+            except Exception as e:
+                print(f"⚠️ Failed to load font {path}: {e}")
+        return ImageFont.load_default()
+
+    def get(self, size: int):
+        key = (self.path, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+            # 加载放在锁内：同一字号并发请求只解析一次
+            font = self._load(key[0], size)
+            self.loads += 1
+            self._fonts[key] = font
+            while len(self._fonts) > self.max_entries:
+                self._fonts.popitem(last=False)
+            return font
+
+    def preload(self, sizes: Iterable[int]) -> None:
+        if not self.preload_enabled:
+            return
+        sizes = list(sizes)
+        for size in sizes:
+            self.get(size)
+        print(f"🔤 Fonts preloaded ({self.path or 'Pillow default'}, {len(sizes)} sizes)")
+
+    def get_status(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "path": self.path,
+                "cached": len(self._fonts),
+                "maxEntries": self.max_entries,
+                "hits": self.hits,
+                "loads": self.loads,
+            }
+
+
+# 全局实例
+font_registry = FontRegistry()
@@ -0,0 +1,106 @@
+"""
+共享异步 HTTP 客户端
+- 基于 httpx.AsyncClient，所有服务共用，避免同步 requests 阻塞事件循环
+- 按 host 维护独立的 keep-alive 连接池
+- 连接数 / keep-alive / 超时均可通过环境变量配置，并支持单次调用覆盖超时
+"""
+
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Union
+from urllib.parse import urlparse
+
+import httpx
+
+TimeoutValue = Union[float, int, httpx.Timeout, None]
+
+
+class AsyncHTTPClient:
+    def __init__(self):
+        self.max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "100"))
+        self.max_keepalive = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "20"))
+        self.keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+        self.connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+        self.default_timeout = float(os.getenv("HTTP_DEFAULT_TIMEOUT", "60"))
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _pool_key(self, url: str) -> str:
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+    def _get_client(self, url: str) -> httpx.AsyncClient:
+        key = self._pool_key(url)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=self._build_timeout(None),
+                follow_redirects=True,
+            )
+            self._clients[key] = client
+        return client
+
+    def _build_timeout(self, timeout: TimeoutValue) -> httpx.Timeout:
+        if isinstance(timeout, httpx.Timeout):
+            return timeout
+        total = float(timeout) if timeout is not None else self.default_timeout
+        return httpx.Timeout(total, connect=min(self.connect_timeout, total))
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        timeout: TimeoutValue = None,
+        **kwargs,
+    ) -> httpx.Response:
+        client = self._get_client(url)
+        return await client.request(
+            method, url, timeout=self._build_timeout(timeout), **kwargs
+        )
+
+    async def get(self, url: str, timeout: TimeoutValue = None, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, timeout=timeout, **kwargs)
+
+    async def post(self, url: str, timeout: TimeoutValue = None, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, timeout=timeout, **kwargs)
+
+    async def head(self, url: str, timeout: TimeoutValue = None, **kwargs) -> httpx.Response:
+        return await self.request("HEAD", url, timeout=timeout, **kwargs)
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        method: str,
+        url: str,
+        timeout: TimeoutValue = None,
+        **kwargs,
+    ) -> AsyncIterator[httpx.Response]:
+        """流式读取响应体（大文件下载时避免整体缓存在内存中）"""
+        client = self._get_client(url)
+        async with client.stream(
+            method, url, timeout=self._build_timeout(timeout), **kwargs
+        ) as response:
+            yield response
+
+    def get_status(self) -> Dict[str, object]:
+        return {
+            "hosts": sorted(self._clients.keys()),
+            "maxConnectionsPerHost": self.max_connections,
+            "maxKeepalivePerHost": self.max_keepalive,
+            "keepaliveExpiry": self.keepalive_expiry,
+            "defaultTimeout": self.default_timeout,
+        }
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+# 全局实例
+http_client = AsyncHTTPClient()
@@ -0,0 +1,213 @@
+"""
+内存图片产物
+- 在提供方 → 后处理 → 存储之间传递，避免每一步都落盘再读回
+- 提供方返回的 PNG/JPEG/WebP 只解析文件头校验格式与尺寸，不做完整解码，
+  无需改动时原样写盘
+- 已有磁盘文件（缓存命中、模板）时按需解码；未改动时落盘直接硬链接
+- 需要改动（文字气泡、格式转换）时才解码，最终输出经 image_encoder 只编码一次
+- 与模板完全相同的输出写为按内容命名的共享文件，多个变体 / 请求指向同一份
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+try:
+    from app.services.image_encoder import EXTENSION_FORMATS, image_encoder
+except ImportError:
+    from services.image_encoder import EXTENSION_FORMATS, image_encoder
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+# 可以原样写盘的格式 → 扩展名
+PASSTHROUGH_FORMATS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+PASSTHROUGH_ENABLED = _env_flag("IMAGE_PASSTHROUGH", True)
+
+# (路径, 修改时间, 大小) → 内容摘要，同一模板只计算一次
+_digest_cache: Dict[Tuple[str, int, int], str] = {}
+_digest_lock = threading.Lock()
+
+
+def _content_digest(path: str) -> str:
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _digest_lock:
+        digest = _digest_cache.get(key)
+    if digest is None:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()[:16]
+        with _digest_lock:
+            _digest_cache[key] = digest
+    return digest
+
+
+class ImageArtifact:
+    def __init__(
+        self,
+        image: Optional[Image.Image] = None,
+        path: Optional[str] = None,
+        data: Optional[bytes] = None,
+        format: Optional[str] = None,
+        size: Optional[Tuple[int, int]] = None,
+        mode: Optional[str] = None,
+        shared: bool = False,
+    ):
+        if image is None and path is None and data is None:
+            raise ValueError("ImageArtifact needs an image, a path or encoded data")
+        self._image = image
+        # path / data 与 image 内容一致的已编码版本（若有）
+        self.path = path
+        self.data = data
+        self.format = format
+        self._size = size or (image.size if image is not None else None)
+        # 解码时转换到的色彩模式（如 SiliconFlow 结果统一转 RGB）
+        self._mode = mode
+        # 内容与 path 处的不可变文件（如模板）一致，落盘时可以共享
+        self.shared = shared
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, mode: Optional[str] = None) -> "ImageArtifact":
+        """
+        接收提供方返回的图片字节
+
+        只解析文件头：PNG/JPEG/WebP 且尺寸合法时保留原始字节，延迟解码；
+        其它格式立即完整解码（失败直接抛出，与原先行为一致）
+        """
+        header = Image.open(BytesIO(data))
+        width, height = header.size
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Invalid image dimensions: {width}x{height}")
+        if PASSTHROUGH_ENABLED and header.format in PASSTHROUGH_FORMATS:
+            return cls(data=data, format=header.format, size=(width, height), mode=mode)
+
+        header.load()
+        image = header.convert(mode) if mode and header.mode != mode else header
+        return cls(image=image)
+
+    @classmethod
+    def from_path(cls, path: str, shared: bool = False) -> "ImageArtifact":
+        return cls(path=path, shared=shared)
+
+    def to_image(self) -> Image.Image:
+        """解码后的图片（共享对象，调用方需要修改时先 copy()）"""
+        with self._lock:
+            if self._image is None:
+                image = Image.open(BytesIO(self.data) if self.data is not None else self.path)
+                image.load()
+                if self._mode and image.mode != self._mode:
+                    image = image.convert(self._mode)
+                self._image = image
+                self._size = image.size
+            return self._image
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        if self._size is None:
+            if self._image is None and self.path:
+                # 只读文件头
+                with Image.open(self.path) as header:
+                    self._size = header.size
+            else:
+                self._size = self.to_image().size
+        return self._size
+
+    @property
+    def source_format(self) -> Optional[str]:
+        """已编码版本的格式（仅内存图片时为 None）"""
+        if self.path:
+            return EXTENSION_FORMATS.get(os.path.splitext(self.path)[1].lower())
+        if self.data is not None:
+            return self.format
+        return None
+
+    def _reusable(self, fmt: Optional[str]) -> bool:
+        return image_encoder.accepts(fmt, self.source_format)
+
+    def extension_for(self, fmt: Optional[str] = None) -> str:
+        """按输出格式落盘时使用的扩展名"""
+        if self._reusable(fmt):
+            if self.path:
+                return os.path.splitext(self.path)[1].lower()
+            return PASSTHROUGH_FORMATS[self.format]
+        return image_encoder.extension(fmt)
+
+    def save(self, output_dir: str, prefix: str = "meme", fmt: Optional[str] = None) -> str:
+        """按输出格式写入 output_dir 并返回新文件路径（fmt 为空时使用服务端默认格式）"""
+        filepath = os.path.join(
+            output_dir, f"{prefix}_{uuid.uuid4().hex[:8]}{self.extension_for(fmt)}"
+        )
+        self.save_as(filepath, fmt)
+        return filepath
+
+    def save_shared(self, output_dir: str, fmt: Optional[str] = None) -> str:
+        """
+        写为按内容命名的共享文件（shared_<摘要>）并返回路径，已存在时直接复用
+
+        只适用于未改动的已有文件；需要编码时退化为 save()
+        """
+        if not (self.path and self._reusable(fmt)):
+            return self.save(output_dir, fmt=fmt)
+        filepath = os.path.join(
+            output_dir, f"shared_{_content_digest(self.path)}{self.extension_for(fmt)}"
+        )
+        if not os.path.exists(filepath):
+            try:
+                os.link(self.path, filepath)
+            except FileExistsError:
+                pass
+            except OSError:
+                tmp_path = f"{filepath}.{uuid.uuid4().hex[:8]}.tmp"
+                shutil.copyfile(self.path, tmp_path)
+                os.replace(tmp_path, filepath)
+        image_encoder.record_passthrough()
+        return filepath
+
+    def save_as(self, filepath: str, fmt: Optional[str] = None) -> None:
+        """
+        已编码版本满足输出格式时硬链接 / 原样写入，否则编码一次
+
+        filepath 的扩展名应来自 extension_for(fmt)
+        """
+        with self._lock:
+            source = self.path
+            data = self.data
+        if self._reusable(fmt):
+            if source and os.path.isfile(source):
+                try:
+                    os.link(source, filepath)
+                except OSError:
+                    shutil.copyfile(source, filepath)
+                image_encoder.record_passthrough()
+                return
+            if data is not None:
+                with open(filepath, "wb") as f:
+                    f.write(data)
+                image_encoder.record_passthrough()
+                self._remember_path(filepath)
+                return
+
+        encoded, _ = image_encoder.encode(self.to_image(), fmt)
+        with open(filepath, "wb") as f:
+            f.write(encoded)
+        self._remember_path(filepath)
+
+    def _remember_path(self, filepath: str) -> None:
+        with self._lock:
+            if self.path is None:
+                self.path = filepath
@@ -0,0 +1,184 @@
+"""
+输出图片编码
+- 统一的输出编码层：PNG（可调压缩级别 / 调色板优化）、WebP（有损 / 无损）、AVIF（可用时）
+- 服务端默认格式 + 单次请求指定格式
+- auto：保留提供方原始编码，需要重新编码时使用 PNG
+- 按格式统计编码次数、耗时与输出字节数
+"""
+
+import os
+import threading
+import time
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import pillow_avif  # noqa: F401  可选依赖：为旧版 Pillow 注册 AVIF 编码器
+except ImportError:
+    pass
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+# 输出格式 → (Pillow 格式名, 扩展名)
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png"),
+    "webp": ("WEBP", ".webp"),
+    "webp_lossless": ("WEBP", ".webp"),
+    "avif": ("AVIF", ".avif"),
+}
+
+# 扩展名 → Pillow 格式名（用于判断已有文件能否原样复用）
+EXTENSION_FORMATS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".webp": "WEBP",
+    ".avif": "AVIF",
+}
+
+
+class ImageEncoder:
+    def __init__(self):
+        Image.init()
+        self.avif_available = "AVIF" in Image.SAVE
+        self.png_compress_level = min(9, max(0, int(os.getenv("OUTPUT_PNG_COMPRESS_LEVEL", "6"))))
+        self.png_optimize = _env_flag("OUTPUT_PNG_OPTIMIZE", False)
+        self.png_palette = _env_flag("OUTPUT_PNG_PALETTE", False)
+        self.webp_quality = int(os.getenv("OUTPUT_WEBP_QUALITY", "85"))
+        self.webp_method = int(os.getenv("OUTPUT_WEBP_METHOD", "4"))
+        self.avif_quality = int(os.getenv("OUTPUT_AVIF_QUALITY", "60"))
+        self.avif_speed = int(os.getenv("OUTPUT_AVIF_SPEED", "6"))
+        self.default_format = "auto"
+        self.default_format = self.resolve_format(os.getenv("OUTPUT_IMAGE_FORMAT"))
+        self.passthrough = 0
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        print(
+            f"🖼️ ImageEncoder initialized (default={self.default_format}, avif={self.avif_available})"
+        )
+
+    def resolve_format(self, fmt: Optional[str] = None) -> str:
+        """规范化输出格式；未指定时使用服务端默认，AVIF 不可用时回退到 WebP"""
+        fmt = (fmt or self.default_format).strip().lower()
+        if fmt != "auto" and fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {fmt}")
+        if fmt == "avif" and not self.avif_available:
+            return "webp"
+        return fmt
+
+    def encoding_format(self, fmt: Optional[str] = None) -> str:
+        """实际编码使用的格式（auto 编码为 PNG）"""
+        fmt = self.resolve_format(fmt)
+        return "png" if fmt == "auto" else fmt
+
+    def accepts(self, fmt: Optional[str], source_format: Optional[str]) -> bool:
+        """
+        已编码的原图能否直接作为该输出格式使用
+
+        只有该格式的编码设置是中性的才原样复用：无损 WebP 无法从文件格式判断原图是否无损，
+        PNG 开启调色板 / optimize 时需要重新编码才能生效，这两种情况始终重新编码
+        """
+        if not source_format:
+            return False
+        fmt = self.resolve_format(fmt)
+        if fmt == "auto":
+            return True
+        if fmt == "webp_lossless":
+            return False
+        if fmt == "png" and (self.png_palette or self.png_optimize):
+            return False
+        return OUTPUT_FORMATS[fmt][0] == source_format.upper()
+
+    def extension(self, fmt: Optional[str] = None) -> str:
+        return OUTPUT_FORMATS[self.encoding_format(fmt)][1]
+
+    def _prepare(self, image: Image.Image, fmt: str) -> Image.Image:
+        has_alpha = image.mode in ("RGBA", "LA") or (
+            image.mode == "P" and "transparency" in image.info
+        )
+        if fmt == "png":
+            if self.png_palette and image.mode != "P":
+                # 调色板优化：卡通风格表情包颜色少，量化到 256 色体积明显下降
+                if has_alpha:
+                    return image.convert("RGBA").quantize(
+                        colors=256, method=Image.Quantize.FASTOCTREE
+                    )
+                return image.convert("RGB").quantize(colors=256)
+            if image.mode in ("CMYK", "YCbCr", "LAB", "HSV"):
+                return image.convert("RGB")
+            return image
+        # WebP / AVIF 只支持 RGB / RGBA
+        target_mode = "RGBA" if has_alpha else "RGB"
+        return image if image.mode == target_mode else image.convert(target_mode)
+
+    def _options(self, fmt: str) -> Dict[str, object]:
+        if fmt == "png":
+            return {"compress_level": self.png_compress_level, "optimize": self.png_optimize}
+        if fmt == "webp":
+            return {"quality": self.webp_quality, "method": self.webp_method}
+        if fmt == "webp_lossless":
+            return {"lossless": True, "quality": 100, "method": self.webp_method}
+        return {"quality": self.avif_quality, "speed": self.avif_speed}
+
+    def encode(self, image: Image.Image, fmt: Optional[str] = None) -> Tuple[bytes, str]:
+        """编码图片，返回 (字节, 扩展名)"""
+        fmt = self.encoding_format(fmt)
+        pil_format, ext = OUTPUT_FORMATS[fmt]
+        started = time.perf_counter()
+        buffer = BytesIO()
+        self._prepare(image, fmt).save(buffer, pil_format, **self._options(fmt))
+        data = buffer.getvalue()
+        self._record(fmt, time.perf_counter() - started, len(data))
+        return data, ext
+
+    def save(self, image: Image.Image, filepath_stem: str, fmt: Optional[str] = None) -> str:
+        """编码并写入 filepath_stem + 扩展名，返回完整路径"""
+        data, ext = self.encode(image, fmt)
+        filepath = f"{filepath_stem}{ext}"
+        with open(filepath, "wb") as f:
+            f.write(data)
+        return filepath
+
+    def record_passthrough(self) -> None:
+        with self._lock:
+            self.passthrough += 1
+
+    def _record(self, fmt: str, seconds: float, size: int) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(fmt, {"count": 0, "seconds": 0.0, "bytes": 0})
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += size
+
+    def get_status(self) -> Dict[str, object]:
+        with self._lock:
+            formats = {
+                fmt: {
+                    "count": stats["count"],
+                    "totalBytes": stats["bytes"],
+                    "avgBytes": round(stats["bytes"] / stats["count"]),
+                    "avgEncodeMs": round(stats["seconds"] * 1000 / stats["count"], 2),
+                }
+                for fmt, stats in self._stats.items()
+            }
+            passthrough = self.passthrough
+        return {
+            "defaultFormat": self.default_format,
+            "supportedFormats": ["auto"]
+            + [fmt for fmt in OUTPUT_FORMATS if fmt != "avif" or self.avif_available],
+            "avifAvailable": self.avif_available,
+            "passthrough": passthrough,
+            "formats": formats,
+        }
+
+
+# 全局实例
+image_encoder = ImageEncoder()
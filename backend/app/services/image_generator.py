@@ -11,15 +11,30 @@
 """
 
 import os
+import time
 import uuid
+import asyncio
 import urllib.parse
-import requests
 import base64
-from typing import Optional, Dict, List
-from io import BytesIO
+from typing import Any, Callable, Optional, Dict, List
 from datetime import datetime
 from dataclasses import dataclass
 
+try:
+    from app.services.http_client import http_client
+    from app.services.image_artifact import ImageArtifact
+    from app.services.init_image_cache import init_image_cache
+    from app.services.result_cache import generation_cache
+    from app.services.provider_health import CircuitOpenError, provider_health
+    from app.services.provider_limiter import ProviderBusyError, provider_limiter
+except ImportError:
+    from services.http_client import http_client
+    from services.image_artifact import ImageArtifact
+    from services.init_image_cache import init_image_cache
+    from services.result_cache import generation_cache
+    from services.provider_health import CircuitOpenError, provider_health
+    from services.provider_limiter import ProviderBusyError, provider_limiter
+
 
 def _env_flag(name: str, default: bool = False) -> bool:
     value = os.getenv(name)
@@ -36,9 +51,22 @@ def _strip_data_url_prefix(data: str) -> str:
 
 @dataclass
 class ImageResult:
-    path: str
+    artifact: ImageArtifact
     provider: str
     is_mock: bool = False
+    cached: bool = False
+    hedged: bool = False
+
+
+# 进度回调：(阶段, 数据)，用于异步任务的事件流
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+PROVIDER_LABELS = {
+    "clipdrop": "Clipdrop",
+    "siliconflow": "SiliconFlow",
+    "webui": "Local WebUI",
+    "pollinations": "Pollinations",
+}
 
 
 class ReplicateGenerator:
@@ -65,7 +93,7 @@ class ReplicateGenerator:
         style: str = "cartoon",
         width: int = 512,
         height: int = 512,
-    ) -> str:
+    ) -> ImageArtifact:
         """使用 Replicate FLUX 生成图片"""
         if not self.api_token:
             raise ValueError("REPLICATE_API_TOKEN not set")
@@ -96,7 +124,7 @@ class ReplicateGenerator:
 
         try:
             # Create prediction
-            response = requests.post(
+            response = await http_client.post(
                 f"{self.api_url}/predictions",
                 headers=headers,
                 json=payload,
@@ -115,31 +143,24 @@ class ReplicateGenerator:
                 get_url = result.get("urls", {}).get("get")
                 if get_url:
                     for _ in range(60):  # Poll for 60 seconds
-                        response = requests.get(get_url, headers=headers, timeout=10)
+                        response = await http_client.get(get_url, headers=headers, timeout=10)
                         result = response.json()
                         if result["status"] == "succeeded":
                             image_url = result["output"]
                             break
                         elif result["status"] == "failed":
                             raise Exception(f"Replicate generation failed")
-                        import time
-                        time.sleep(1)
+                        await asyncio.sleep(1)
                 else:
                     raise Exception("No output URL in response")
 
             # Download image
-            image_response = requests.get(image_url, timeout=60)
+            image_response = await http_client.get(image_url, timeout=60)
             image_response.raise_for_status()
 
-            from PIL import Image
-            image = Image.open(BytesIO(image_response.content))
-
-            filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-            filepath = os.path.join(self.upload_dir, filename)
-            image.save(filepath, "PNG")
-
-            print(f"✅ Image saved: {filename}")
-            return filepath
+            artifact = ImageArtifact.from_bytes(image_response.content)
+            print(f"✅ Image received: {artifact.size[0]}x{artifact.size[1]}")
+            return artifact
 
         except Exception as e:
             print(f"❌ Replicate error: {e}")
@@ -190,7 +211,7 @@ class HuggingFaceGenerator:
         style: str = "cartoon",
         width: int = 512,
         height: int = 512,
-    ) -> str:
+    ) -> ImageArtifact:
         """使用 Hugging Face Router 生成图片"""
         if not self.api_token:
             raise ValueError("HUGGINGFACE_API_TOKEN not set")
@@ -217,7 +238,7 @@ class HuggingFaceGenerator:
         }
 
         try:
-            response = requests.post(
+            response = await http_client.post(
                 f"https://router.huggingface.co/{model}",
                 headers=headers,
                 json=payload,
@@ -225,15 +246,9 @@ class HuggingFaceGenerator:
             )
             response.raise_for_status()
 
-            from PIL import Image
-            image = Image.open(BytesIO(response.content))
-
-            filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-            filepath = os.path.join(self.upload_dir, filename)
-            image.save(filepath, "PNG")
-
-            print(f"✅ Image saved: {filename}")
-            return filepath
+            artifact = ImageArtifact.from_bytes(response.content)
+            print(f"✅ Image received: {artifact.size[0]}x{artifact.size[1]}")
+            return artifact
 
         except Exception as e:
             print(f"❌ Hugging Face error: {e}")
@@ -279,7 +294,8 @@ class LocalWebUIGenerator:
         style: str = "cartoon",
         width: int = 512,
         height: int = 512,
-    ) -> str:
+        seed: Optional[int] = None,
+    ) -> ImageArtifact:
         """调用本地 SD WebUI 生成图片"""
         if not self.base_url:
             raise ValueError("SD_WEBUI_URL not set")
@@ -297,10 +313,11 @@ class LocalWebUIGenerator:
             "steps": int(os.getenv("SD_WEBUI_STEPS", "20")),
             "cfg_scale": float(os.getenv("SD_WEBUI_CFG", "7")),
             "sampler_name": os.getenv("SD_WEBUI_SAMPLER", "Euler a"),
+            "seed": seed if seed is not None else -1,
         }
 
         try:
-            response = requests.post(
+            response = await http_client.post(
                 f"{self.base_url}/sdapi/v1/txt2img",
                 json=payload,
                 timeout=180,
@@ -314,15 +331,9 @@ class LocalWebUIGenerator:
 
             image_data = base64.b64decode(_strip_data_url_prefix(images[0]))
 
-            from PIL import Image
-            image = Image.open(BytesIO(image_data))
-
-            filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-            filepath = os.path.join(self.upload_dir, filename)
-            image.save(filepath, "PNG")
-
-            print(f"✅ Image saved: {filename}")
-            return filepath
+            artifact = ImageArtifact.from_bytes(image_data)
+            print(f"✅ Image received: {artifact.size[0]}x{artifact.size[1]}")
+            return artifact
         except Exception as e:
             print(f"❌ Local SD WebUI error: {e}")
             raise
@@ -333,20 +344,16 @@ class LocalWebUIGenerator:
         image_path: str,
         style: str = "cartoon",
         denoise_strength: Optional[float] = None,
-    ) -> str:
+        seed: Optional[int] = None,
+    ) -> ImageArtifact:
         if not self.base_url:
             raise ValueError("SD_WEBUI_URL not set")
 
         print("🧪 Generating image with Local SD WebUI (img2img)...")
         enhanced_prompt = self._build_enhanced_prompt(prompt, style)
 
-        from PIL import Image
-        image = Image.open(image_path).convert("RGB")
-        width, height = image.size
-
-        buffer = BytesIO()
-        image.save(buffer, format="PNG")
-        init_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        # 同一模板的缩放 + 编码结果只计算一次
+        init_image, width, height = await asyncio.to_thread(init_image_cache.get, image_path)
 
         payload = {
             "prompt": enhanced_prompt,
@@ -359,10 +366,11 @@ class LocalWebUIGenerator:
             "denoising_strength": denoise_strength
             if denoise_strength is not None
             else float(os.getenv("SD_WEBUI_DENOISE", "0.55")),
+            "seed": seed if seed is not None else -1,
             "init_images": [init_image],
         }
 
-        response = requests.post(
+        response = await http_client.post(
             f"{self.base_url}/sdapi/v1/img2img",
             json=payload,
             timeout=180,
@@ -374,12 +382,7 @@ class LocalWebUIGenerator:
             raise Exception("No images in img2img response")
 
         image_data = base64.b64decode(_strip_data_url_prefix(images[0]))
-        output = Image.open(BytesIO(image_data))
-
-        filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-        filepath = os.path.join(self.upload_dir, filename)
-        output.save(filepath, "PNG")
-        return filepath
+        return ImageArtifact.from_bytes(image_data)
 
     def _build_enhanced_prompt(self, prompt: str, style: str) -> str:
         style_enhancements = {
@@ -421,7 +424,8 @@ class ClipdropGenerator:
         style: str = "cartoon",
         width: int = 512,
         height: int = 512,
-    ) -> str:
+        seed: Optional[int] = None,
+    ) -> ImageArtifact:
         if not self.api_key:
             raise ValueError("CLIPDROP_API_KEY not set")
 
@@ -431,11 +435,11 @@ class ClipdropGenerator:
         enhanced_prompt = self._build_enhanced_prompt(prompt, style)
 
         headers = {"x-api-key": self.api_key, "accept": "image/png"}
-        # Clipdrop expects multipart/form-data
+        # Clipdrop expects multipart/form-data（文生图接口不支持 seed）
         files = {"prompt": (None, enhanced_prompt)}
 
         try:
-            response = requests.post(
+            response = await http_client.post(
                 self.api_url,
                 headers=headers,
                 files=files,
@@ -452,15 +456,9 @@ class ClipdropGenerator:
             if "image" not in content_type:
                 raise Exception(f"Non-image response: {content_type}")
 
-            from PIL import Image
-            image = Image.open(BytesIO(response.content))
-
-            filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-            filepath = os.path.join(self.upload_dir, filename)
-            image.save(filepath, "PNG")
-
-            print(f"✅ Image saved: {filename}")
-            return filepath
+            artifact = ImageArtifact.from_bytes(response.content)
+            print(f"✅ Image received: {artifact.size[0]}x{artifact.size[1]}")
+            return artifact
         except Exception as e:
             print(f"❌ Clipdrop error: {e}")
             raise
@@ -510,7 +508,8 @@ class SiliconFlowGenerator:
         style: str = "cartoon",
         width: int = 512,
         height: int = 512,
-    ) -> str:
+        seed: Optional[int] = None,
+    ) -> ImageArtifact:
         if not self.is_available():
             raise ValueError("SILICONFLOW_API_KEY/SILICONFLOW_API_URL not set")
 
@@ -530,8 +529,10 @@ class SiliconFlowGenerator:
             "size": f"{int(width)}x{int(height)}",
             "response_format": "b64_json",
         }
+        if seed is not None:
+            payload["seed"] = seed
 
-        response = requests.post(
+        response = await http_client.post(
             self.api_url,
             headers=headers,
             json=payload,
@@ -543,20 +544,15 @@ class SiliconFlowGenerator:
         response.raise_for_status()
         data = response.json()
 
-        image_bytes = self._extract_image_bytes(data)
+        image_bytes = await self._extract_image_bytes(data)
         if not image_bytes:
             raise Exception("No image found in SiliconFlow response")
 
-        from PIL import Image
+        artifact = ImageArtifact.from_bytes(image_bytes, mode="RGB")
+        print(f"✅ Image received: {artifact.size[0]}x{artifact.size[1]}")
+        return artifact
 
-        image = Image.open(BytesIO(image_bytes)).convert("RGB")
-        filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-        filepath = os.path.join(self.upload_dir, filename)
-        image.save(filepath, "PNG")
-        print(f"✅ Image saved: {filename}")
-        return filepath
-
-    def _extract_image_bytes(self, data: dict) -> Optional[bytes]:
+    async def _extract_image_bytes(self, data: dict) -> Optional[bytes]:
         items = data.get("data") if isinstance(data, dict) else None
         if isinstance(items, list) and items:
             first = items[0]
@@ -564,7 +560,7 @@ class SiliconFlowGenerator:
                 if first.get("b64_json"):
                     return base64.b64decode(first["b64_json"])
                 if first.get("url"):
-                    response = requests.get(first["url"], timeout=self.timeout)
+                    response = await http_client.get(first["url"], timeout=self.timeout)
                     response.raise_for_status()
                     return response.content
 
@@ -572,14 +568,14 @@ class SiliconFlowGenerator:
         if isinstance(images, list) and images:
             first = images[0]
             if isinstance(first, str):
-                response = requests.get(first, timeout=self.timeout)
+                response = await http_client.get(first, timeout=self.timeout)
                 response.raise_for_status()
                 return response.content
             if isinstance(first, dict):
                 if first.get("b64_json"):
                     return base64.b64decode(first["b64_json"])
                 if first.get("url"):
-                    response = requests.get(first["url"], timeout=self.timeout)
+                    response = await http_client.get(first["url"], timeout=self.timeout)
                     response.raise_for_status()
                     return response.content
 
@@ -617,7 +613,8 @@ class PollinationsGenerator:
         style: str = "cartoon",
         width: int = 512,
         height: int = 512,
-    ) -> str:
+        seed: Optional[int] = None,
+    ) -> ImageArtifact:
         """使用 Pollinations.ai 生成图片"""
         print(f"🌐 Generating image with Pollinations.ai...")
 
@@ -627,7 +624,7 @@ class PollinationsGenerator:
             "width": width,
             "height": height,
             "nologo": "true",
-            "seed": uuid.uuid4().int & 0xFFFFFFFF,
+            "seed": seed if seed is not None else uuid.uuid4().int & 0xFFFFFFFF,
         }
 
         url = f"{self.base_url}/{encoded_prompt}?{'&'.join([f'{k}={v}' for k, v in params.items()])}"
@@ -635,22 +632,16 @@ class PollinationsGenerator:
         print(f"   URL: {url[:80]}...")
 
         try:
-            response = requests.get(url, timeout=120)
+            response = await http_client.get(url, timeout=120)
             response.raise_for_status()
 
             content_type = response.headers.get("Content-Type", "")
             if "image" not in content_type:
                 raise Exception(f"Non-image response: {content_type}")
 
-            from PIL import Image
-            image = Image.open(BytesIO(response.content))
-
-            filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-            filepath = os.path.join(self.upload_dir, filename)
-            image.save(filepath, "PNG")
-
-            print(f"✅ Image saved: {filename}")
-            return filepath
+            artifact = ImageArtifact.from_bytes(response.content)
+            print(f"✅ Image received: {artifact.size[0]}x{artifact.size[1]}")
+            return artifact
         except Exception as e:
             print(f"❌ Pollinations error: {e}")
             raise
@@ -703,6 +694,16 @@ class ImageGenerator:
         )
         self.provider_order = self._build_provider_order(order_env)
 
+        # 对冲请求：主提供方超过其耗时分位数仍未返回时并行请求下一个提供方
+        self.hedge_enabled = _env_flag("IMAGE_GENERATION_HEDGE", False)
+        self.hedge_percentile = float(os.getenv("IMAGE_GENERATION_HEDGE_PERCENTILE", "0.9"))
+        self.hedge_min_samples = int(os.getenv("IMAGE_GENERATION_HEDGE_MIN_SAMPLES", "5"))
+        self.hedge_default_delay = float(os.getenv("IMAGE_GENERATION_HEDGE_DELAY", "15"))
+        self.hedge_min_delay = float(os.getenv("IMAGE_GENERATION_HEDGE_MIN_DELAY", "1"))
+
+        # 自适应顺序：按 EWMA 耗时 / 错误率和熔断状态重排提供方
+        self.adaptive_order = _env_flag("IMAGE_GENERATION_ADAPTIVE_ORDER", True)
+
         print(f"\n🎨 ImageGenerator initialized")
         print(f"   Upload dir: {self.upload_dir}")
         print(f"\n📊 Provider Priority:")
@@ -734,6 +735,10 @@ class ImageGenerator:
             print(f"\n🎯 Forced provider: {self.forced_provider}")
         if self.provider_order:
             print(f"🔀 Provider order: {', '.join(self.provider_order)}")
+        if self.hedge_enabled:
+            print(f"🪁 Hedging enabled (p{int(self.hedge_percentile * 100)})")
+        if self.adaptive_order and not self.forced_provider:
+            print("📈 Adaptive provider order enabled")
         print("")
 
     def _build_provider_order(self, order_env: Optional[str]) -> List[str]:
@@ -746,6 +751,71 @@ class ImageGenerator:
             return items or ["clipdrop", "siliconflow", "webui", "pollinations", "mock"]
         return ["clipdrop", "siliconflow", "webui", "pollinations", "mock"]
 
+    def _resolve_providers(self, preferred_provider: Optional[str] = None) -> List[str]:
+        """本次生成的提供方尝试顺序；preferred_provider 会被提到最前（强制提供方时忽略）"""
+        if self.forced_provider:
+            return [self.forced_provider.lower()]
+        providers = list(self.provider_order)
+        if preferred_provider and preferred_provider in providers:
+            providers.remove(preferred_provider)
+            providers.insert(0, preferred_provider)
+        return providers
+
+    def _rank_providers(
+        self, providers: List[str], preferred_provider: Optional[str] = None
+    ) -> List[str]:
+        """按运行时健康度重排（强制提供方或关闭自适应时保持原顺序）"""
+        if not self.adaptive_order or self.forced_provider:
+            return providers
+        ranked = provider_health.rank(providers)
+        if preferred_provider in ranked and not provider_health.is_open(preferred_provider):
+            ranked.remove(preferred_provider)
+            ranked.insert(0, preferred_provider)
+        return ranked
+
+    def _is_provider_available(self, name: str) -> bool:
+        if name == "clipdrop":
+            return self.clipdrop.is_available()
+        if name == "siliconflow":
+            return self.siliconflow.is_available()
+        if name == "webui":
+            return self.webui.is_available()
+        if name == "pollinations":
+            return self.pollinations_enabled
+        return name == "mock"
+
+    def get_available_providers(self) -> List[str]:
+        """当前可用的真实提供方（不含 mock），按优先级排序"""
+        return [
+            name
+            for name in self._resolve_providers()
+            if name != "mock" and self._is_provider_available(name)
+        ]
+
+    def get_provider_signature(self, preferred_provider: Optional[str] = None) -> str:
+        """当前生效的提供方选择（用于请求合并/缓存键）"""
+        return ",".join(self._resolve_providers(preferred_provider))
+
+    def get_provider_health(self) -> Dict[str, object]:
+        return {
+            "hedging": {
+                "enabled": self.hedge_enabled,
+                "percentile": self.hedge_percentile,
+                "defaultDelay": self.hedge_default_delay,
+            },
+            "adaptiveOrder": {
+                "enabled": self.adaptive_order and not self.forced_provider,
+                "effectiveOrder": self._rank_providers(self.get_available_providers()),
+            },
+            "breaker": {
+                "failureThreshold": provider_health.breaker_failures,
+                "cooldown": provider_health.breaker_cooldown,
+            },
+            "providers": provider_health.get_status(),
+            "limits": provider_limiter.get_status(),
+            "initImageCache": init_image_cache.get_status(),
+        }
+
     def get_provider_status(self) -> List[Dict[str, str]]:
         status = []
         providers = self.provider_order or []
@@ -812,62 +882,237 @@ class ImageGenerator:
         style: str = "cartoon",
         width: int = 512,
         height: int = 512,
+        seed: Optional[int] = None,
+        use_cache: bool = True,
+        on_event: Optional[ProgressCallback] = None,
+        preferred_provider: Optional[str] = None,
+        variant: int = 0,
     ) -> ImageResult:
         """
         生成图片 - 自动选择最佳可用方式
 
         Priority: Clipdrop → SiliconFlow → Local WebUI → Pollinations → Mock
+
+        相同 (prompt, style, 提供方, 尺寸, seed, 变体序号) 优先命中磁盘缓存；
+        seed 原样传给支持的提供方（为 None 时由提供方随机），
+        variant 让同一请求的多个变体各占一个缓存位。
+        use_cache=False 时跳过缓存，强制重新生成。
+        preferred_provider 用于批量任务在多个提供方之间分摊负载。
         """
-        errors = []
+        cache_key = None
+        if use_cache and generation_cache.enabled:
+            cache_key = generation_cache.build_key(
+                kind="txt2img",
+                prompt=prompt,
+                style=style,
+                provider=self.get_provider_signature(preferred_provider),
+                width=width,
+                height=height,
+                seed=seed,
+                variant=variant,
+                template=None,
+            )
+            hit = await asyncio.to_thread(generation_cache.get, cache_key)
+            if hit:
+                print(f"🗄️ Generation cache hit ({cache_key[:8]})")
+                if on_event:
+                    on_event("cache_hit", {"provider": hit["provider"]})
+                return ImageResult(
+                    artifact=ImageArtifact.from_path(hit["path"]),
+                    provider=hit["provider"],
+                    cached=True,
+                )
 
-        providers = self.provider_order
-        if self.forced_provider:
-            providers = [self.forced_provider.lower()]
+        result = await self._generate_with_providers(
+            prompt,
+            style,
+            width,
+            height,
+            on_event=on_event,
+            preferred_provider=preferred_provider,
+            seed=seed,
+        )
+        if cache_key and not result.is_mock:
+            await asyncio.to_thread(
+                generation_cache.put_artifact, cache_key, result.artifact, result.provider
+            )
+        return result
 
-        for provider in providers:
-            if provider == "clipdrop":
-                if not self.clipdrop.is_available():
-                    continue
-                try:
-                    path = await self.clipdrop.generate(prompt, style, width, height)
-                    return ImageResult(path=path, provider="clipdrop")
-                except Exception as e:
-                    print(f"⚠️ Clipdrop failed: {e}")
-                    errors.append(f"clipdrop: {e}")
-            elif provider == "siliconflow":
-                if not self.siliconflow.is_available():
-                    continue
-                try:
-                    path = await self.siliconflow.generate(prompt, style, width, height)
-                    return ImageResult(path=path, provider="siliconflow")
-                except Exception as e:
-                    print(f"⚠️ SiliconFlow failed: {e}")
-                    errors.append(f"siliconflow: {e}")
-            elif provider == "webui":
-                if not self.webui.is_available():
-                    continue
-                try:
-                    path = await self.webui.generate(prompt, style, width, height)
-                    return ImageResult(path=path, provider="webui")
-                except Exception as e:
-                    print(f"⚠️ Local WebUI failed: {e}")
-                    errors.append(f"webui: {e}")
-            elif provider == "pollinations":
-                if not self.pollinations_enabled:
-                    continue
+    async def _generate_with_providers(
+        self,
+        prompt: str,
+        style: str,
+        width: int,
+        height: int,
+        on_event: Optional[ProgressCallback] = None,
+        preferred_provider: Optional[str] = None,
+        seed: Optional[int] = None,
+    ) -> ImageResult:
+        errors = []
+
+        providers = self._resolve_providers(preferred_provider)
+        # mock 之后的提供方不会被尝试（与原先的顺序语义一致）
+        if "mock" in providers:
+            providers = providers[: providers.index("mock")]
+        candidates = []
+        for name in self._rank_providers(providers, preferred_provider):
+            if not self._is_provider_available(name):
+                continue
+            if provider_health.is_open(name):
+                print(f"⛔ {PROVIDER_LABELS.get(name, name)} skipped (circuit open)")
+                continue
+            candidates.append(name)
+
+        def _attempt(name: str, hedge: bool = False):
+            if on_event:
+                on_event("provider_attempted", {"provider": name, "hedge": hedge})
+
+        def _failed(name: str, error: BaseException):
+            print(f"⚠️ {PROVIDER_LABELS.get(name, name)} failed: {error}")
+            errors.append(f"{name}: {error}")
+            if on_event:
+                on_event("provider_failed", {"provider": name, "error": str(error)})
+
+        if self.hedge_enabled and len(candidates) > 1:
+            result = await self._generate_hedged(
+                candidates, prompt, style, width, height, _attempt, _failed, seed=seed
+            )
+            if result:
+                return result
+        else:
+            for name in candidates:
+                _attempt(name)
                 try:
-                    path = await self.pollinations.generate(prompt, style, width, height)
-                    return ImageResult(path=path, provider="pollinations")
+                    artifact = await self._call_provider(
+                        name, prompt, style, width, height, seed=seed
+                    )
+                    return ImageResult(artifact=artifact, provider=name)
+                except ProviderBusyError:
+                    # 排队超时不是提供方故障：不转向其它提供方或 mock，由接口返回 429
+                    raise
                 except Exception as e:
-                    print(f"⚠️ Pollinations failed: {e}")
-                    errors.append(f"pollinations: {e}")
-            elif provider == "mock":
-                print("🎭 Using Mock provider")
-                return await self._generate_mock(prompt, style)
+                    _failed(name, e)
 
-        print("🎭 All providers failed, using Mock")
+        if candidates:
+            print("🎭 All providers failed, using Mock")
+        else:
+            print("🎭 Using Mock provider")
+        _attempt("mock")
         return await self._generate_mock(prompt, style)
 
+    async def _call_provider(
+        self,
+        name: str,
+        prompt: str,
+        style: str,
+        width: int,
+        height: int,
+        seed: Optional[int] = None,
+    ) -> ImageArtifact:
+        """调用单个提供方（受并发/速率限制）并记录耗时/成败"""
+        generator = {
+            "clipdrop": self.clipdrop,
+            "siliconflow": self.siliconflow,
+            "webui": self.webui,
+            "pollinations": self.pollinations,
+        }[name]
+        # 先在限流器排队，拿到槽位后再检查熔断，避免半开试探名额在排队中被占用
+        async with provider_limiter.slot(name):
+            if not provider_health.acquire(name):
+                raise CircuitOpenError(f"{name} circuit is open")
+            started = time.monotonic()
+            try:
+                artifact = await generator.generate(prompt, style, width, height, seed=seed)
+            except asyncio.CancelledError:
+                # 被取消的调用（如对冲落败）不计入统计，但要归还半开试探名额
+                provider_health.release(name)
+                raise
+            except Exception:
+                provider_health.record(name, time.monotonic() - started, success=False)
+                raise
+            provider_health.record(name, time.monotonic() - started, success=True)
+            return artifact
+
+    def _hedge_delay(self, provider: str) -> float:
+        observed = provider_health.latency_percentile(
+            provider, self.hedge_percentile, min_samples=self.hedge_min_samples
+        )
+        if observed is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, observed)
+
+    async def _generate_hedged(
+        self,
+        candidates: List[str],
+        prompt: str,
+        style: str,
+        width: int,
+        height: int,
+        on_attempt: Callable[..., None],
+        on_failed: Callable[[str, BaseException], None],
+        seed: Optional[int] = None,
+    ) -> Optional[ImageResult]:
+        """
+        对冲请求：主提供方超过其历史耗时分位数仍未返回时，
+        向下一个可用提供方并行发起请求，先成功者胜出，其余取消。
+        """
+        in_flight: Dict[asyncio.Task, str] = {}
+        started_at: Dict[asyncio.Task, float] = {}
+        next_index = 0
+        hedged = False
+        busy: Optional[ProviderBusyError] = None
+
+        def _start(hedge: bool):
+            nonlocal next_index
+            name = candidates[next_index]
+            next_index += 1
+            on_attempt(name, hedge)
+            task = asyncio.create_task(
+                self._call_provider(name, prompt, style, width, height, seed=seed)
+            )
+            in_flight[task] = name
+            started_at[task] = time.monotonic()
+
+        try:
+            while next_index < len(candidates) or in_flight:
+                if not in_flight:
+                    _start(hedge=False)
+
+                timeout = None
+                if len(in_flight) == 1 and next_index < len(candidates):
+                    (primary,) = in_flight
+                    elapsed = time.monotonic() - started_at[primary]
+                    timeout = max(0.0, self._hedge_delay(in_flight[primary]) - elapsed)
+
+                done, _ = await asyncio.wait(
+                    in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    slow_provider = in_flight[next(iter(in_flight))]
+                    print(f"🪁 Hedging: {slow_provider} is slow, also trying {candidates[next_index]}")
+                    hedged = True
+                    _start(hedge=True)
+                    continue
+
+                for task in done:
+                    name = in_flight.pop(task)
+                    started_at.pop(task, None)
+                    error = task.exception()
+                    if error is None:
+                        return ImageResult(artifact=task.result(), provider=name, hedged=hedged)
+                    if isinstance(error, ProviderBusyError):
+                        busy = error
+                        continue
+                    on_failed(name, error)
+                # 排队超时的对冲请求直接放弃；没有其它请求在进行时不再转向下一个提供方
+                if busy is not None and not in_flight:
+                    raise busy
+            return None
+        finally:
+            # 胜出或整体被取消时，取消仍在进行的请求
+            for task in in_flight:
+                task.cancel()
+
     async def _generate_mock(self, prompt: str, style: str) -> ImageResult:
         """Mock 生成（开发测试用）"""
         from PIL import Image, ImageDraw, ImageFont
@@ -894,33 +1139,71 @@ class ImageGenerator:
         draw.text(((w - 100) // 2, y + 40), f"Style: {style}", fill=0x94A3B8, font=font)
         draw.text(((w - 80) // 2, y + 80), "[MOCK]", fill=0xF43F5E, font=font)
 
-        filename = f"meme_{uuid.uuid4().hex[:8]}.png"
-        filepath = os.path.join(self.upload_dir, filename)
-        image.save(filepath)
-
-        print(f"✅ Mock image saved: {filename}")
-        return ImageResult(path=filepath, provider="mock", is_mock=True)
+        print("✅ Mock image generated")
+        return ImageResult(artifact=ImageArtifact(image=image), provider="mock", is_mock=True)
 
     async def generate_from_template(
         self,
         optimized_prompt: str,
         template_path: str,
         style: str = "cartoon",
+        template_id: Optional[str] = None,
+        seed: Optional[int] = None,
+        use_cache: bool = True,
+        on_event: Optional[ProgressCallback] = None,
+        variant: int = 0,
     ) -> ImageResult:
         """
         尝试用本地 WebUI img2img 将提示词应用到模板。
         若 WebUI 不可用则回退为原模板。
         """
         if self.webui.is_available():
+            cache_key = None
+            if use_cache and template_id and generation_cache.enabled:
+                cache_key = generation_cache.build_key(
+                    kind="img2img",
+                    prompt=optimized_prompt,
+                    style=style,
+                    provider="webui_img2img",
+                    width=None,
+                    height=None,
+                    seed=seed,
+                    variant=variant,
+                    template=template_id,
+                )
+                hit = await asyncio.to_thread(generation_cache.get, cache_key)
+                if hit:
+                    print(f"🗄️ Generation cache hit ({cache_key[:8]})")
+                    if on_event:
+                        on_event("cache_hit", {"provider": hit["provider"]})
+                    return ImageResult(
+                        artifact=ImageArtifact.from_path(hit["path"]),
+                        provider=hit["provider"],
+                        cached=True,
+                    )
+
+            if on_event:
+                on_event("provider_attempted", {"provider": "webui_img2img"})
             try:
-                path = await self.webui.img2img(
-                    optimized_prompt, template_path, style=style
+                artifact = await self.webui.img2img(
+                    optimized_prompt, template_path, style=style, seed=seed
                 )
-                return ImageResult(path=path, provider="webui_img2img")
+                if cache_key:
+                    await asyncio.to_thread(
+                        generation_cache.put_artifact, cache_key, artifact, "webui_img2img"
+                    )
+                return ImageResult(artifact=artifact, provider="webui_img2img")
             except Exception as e:
                 print(f"⚠️ WebUI img2img failed: {e}")
-
-        return ImageResult(path=template_path, provider="template", is_mock=False)
+                if on_event:
+                    on_event("provider_failed", {"provider": "webui_img2img", "error": str(e)})
+
+        # 输出与模板相同，落盘时指向共享文件而不是每个变体各存一份
+        return ImageResult(
+            artifact=ImageArtifact.from_path(template_path, shared=True),
+            provider="template",
+            is_mock=False,
+        )
 
 
 # 全局实例
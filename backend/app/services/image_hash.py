@@ -0,0 +1,323 @@
+"""
+感知哈希索引
+- aHash / dHash / pHash（均为 64 位），用汉明距离衡量两张图是否相似
+- 按 pHash 建 BK 树，相似查询只访问距离范围内的分支，不逐个比对全部图片
+- 记录文件修改时间与大小，文件变化后重新计算；索引持久化到 static/cache，重启后无需重算
+- 文件删除后（上传目录回收）同步移除条目；移除累积到一定数量时重建 BK 树，清掉空节点
+- 两个实例：模板（同步时去重、相似模板查询）与生成结果（相似结果查询）
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+HASH_KINDS = ("phash", "dhash", "ahash")
+
+# 移除的条目数超过 max(该值, 现存条目数) 时重建 BK 树
+COMPACT_MIN_REMOVED = 256
+
+# pHash 只需要 32x32 DCT 的左上 8x8 低频系数
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_DCT_COS = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(_DCT_KEEP)
+]
+
+
+def _bits(values: List[float], threshold: float) -> int:
+    result = 0
+    for value in values:
+        result = (result << 1) | (1 if value > threshold else 0)
+    return result
+
+
+def average_hash(image: Image.Image) -> int:
+    pixels = list(image.convert("L").resize((8, 8), Image.BILINEAR).getdata())
+    return _bits(pixels, sum(pixels) / len(pixels))
+
+
+def difference_hash(image: Image.Image) -> int:
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    result = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            result = (result << 1) | (1 if left > right else 0)
+    return result
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    size = _DCT_SIZE
+    pixels = list(image.convert("L").resize((size, size), Image.BILINEAR).getdata())
+    rows = [pixels[y * size : (y + 1) * size] for y in range(size)]
+    # 先对每行做 DCT（只保留前 8 个系数），再对列做 DCT
+    row_dct = [
+        [sum(c * p for c, p in zip(_DCT_COS[u], row)) for u in range(_DCT_KEEP)] for row in rows
+    ]
+    coefficients = []
+    for v in range(_DCT_KEEP):
+        cos_v = _DCT_COS[v]
+        for u in range(_DCT_KEEP):
+            coefficients.append(sum(cos_v[y] * row_dct[y][u] for y in range(size)))
+    # 直流分量不参与中位数计算
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+    return _bits(coefficients, median)
+
+
+def compute_hashes(path: str) -> Dict[str, int]:
+    with Image.open(path) as image:
+        # JPEG 解码时直接缩小，哈希只需要很小的图
+        image.draft("L", (64, 64))
+        image = image.convert("L")
+        return {
+            "phash": perceptual_hash(image),
+            "dhash": difference_hash(image),
+            "ahash": average_hash(image),
+        }
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """汉明距离 BK 树；相同哈希的多个键挂在同一节点"""
+
+    def __init__(self):
+        # 节点：[哈希值, 键集合, {距离: 子节点}]
+        self._root: Optional[list] = None
+
+    def add(self, value: int, key: str) -> None:
+        if self._root is None:
+            self._root = [value, {key}, {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].add(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, {key}, {}]
+                return
+            node = child
+
+    def remove(self, value: int, key: str) -> None:
+        """只移除键，空节点保留用于路由"""
+        node = self._root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].discard(key)
+                return
+            node = node[2].get(distance)
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, str]]:
+        results = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, key) for key in node[1])
+            # 三角不等式：只有距离在 [d - r, d + r] 的子树可能命中
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+class ImageHashIndex:
+    def __init__(self, name: str):
+        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        project_root = os.path.dirname(backend_dir)
+        cache_dir = os.path.join(project_root, "static", "cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.name = name
+        self.index_path = os.path.join(cache_dir, f"image_hashes_{name}.json")
+        self.max_distance = int(os.getenv("IMAGE_HASH_MAX_DISTANCE", "12"))
+        self.duplicate_distance = int(os.getenv("IMAGE_HASH_DUPLICATE_DISTANCE", "4"))
+        self.flush_interval = 10.0
+
+        self._entries: Dict[str, Dict[str, object]] = {}
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = time.time()
+        # 上次重建以来移除的条目数（BK 树里对应的空节点只用于路由）
+        self._removed = 0
+        self.computed = 0
+        self.compactions = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        if not isinstance(data, dict):
+            return
+        for key, entry in data.items():
+            try:
+                for kind in HASH_KINDS:
+                    entry[kind] = int(entry[kind], 16)
+            except (KeyError, TypeError, ValueError):
+                continue
+            self._entries[key] = entry
+            self._tree.add(entry["phash"], key)
+
+    def flush(self) -> None:
+        # _flush_lock 串行化写盘：GC 线程与后台哈希任务可能同时落盘，共用同一个临时文件
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {
+                    key: {**entry, **{kind: f"{entry[kind]:016x}" for kind in HASH_KINDS}}
+                    for key, entry in self._entries.items()
+                }
+                self._dirty = False
+                self._last_flush = time.time()
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.index_path)
+
+    def _maybe_flush(self) -> None:
+        if self._dirty and time.time() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def update(self, key: str, path: str) -> Dict[str, object]:
+        """返回 key 对应文件的哈希，文件未变化时直接使用索引（阻塞调用）"""
+        stat = os.stat(path)
+        signature = [stat.st_mtime_ns, stat.st_size]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.get("path") == path and entry.get("signature") == signature:
+                return entry
+
+        hashes = compute_hashes(path)
+        entry = {"path": path, "signature": signature, **hashes}
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._tree.remove(old["phash"], key)
+            self._entries[key] = entry
+            self._tree.add(entry["phash"], key)
+            self._dirty = True
+            self.computed += 1
+        self._maybe_flush()
+        return entry
+
+    def _remove_locked(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._tree.remove(entry["phash"], key)
+        self._removed += 1
+        self._dirty = True
+        return True
+
+    def _maybe_compact(self) -> None:
+        """需持有 _lock；空节点累积过多时按现存条目重建 BK 树"""
+        if self._removed <= max(COMPACT_MIN_REMOVED, len(self._entries)):
+            return
+        tree = BKTree()
+        for key, entry in self._entries.items():
+            tree.add(entry["phash"], key)
+        self._tree = tree
+        self._removed = 0
+        self.compactions += 1
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            if not self._remove_locked(key):
+                return
+            self._maybe_compact()
+        self._maybe_flush()
+
+    def remove_many(self, keys: List[str]) -> int:
+        """批量移除（文件已被删除），有变化时立即落盘；返回实际移除的条目数"""
+        with self._lock:
+            removed = sum(1 for key in keys if self._remove_locked(key))
+            if removed:
+                self._maybe_compact()
+        if removed:
+            self.flush()
+        return removed
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def search(
+        self,
+        hashes: Dict[str, int],
+        max_distance: Optional[int] = None,
+        exclude: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[Tuple[int, str]]:
+        """按 pHash 距离（dHash 距离辅助排序）返回 [(距离, 键)]，自动剔除文件已不存在的条目"""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        with self._lock:
+            candidates = self._tree.search(hashes["phash"], max_distance)
+            ranked = []
+            for distance, key in candidates:
+                if key == exclude:
+                    continue
+                entry = self._entries[key]
+                ranked.append((distance, hamming(hashes["dhash"], entry["dhash"]), key))
+        ranked.sort()
+
+        results = []
+        for distance, _, key in ranked:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if not os.path.exists(entry["path"]):
+                self.remove(key)
+                continue
+            results.append((distance, key))
+            if len(results) >= limit:
+                break
+        return results
+
+    def find_duplicate(self, key: str, hashes: Dict[str, int]) -> Optional[Tuple[int, str]]:
+        """pHash 与 dHash 都在阈值内视为重复"""
+        for distance, other in self.search(
+            hashes, max_distance=self.duplicate_distance, exclude=key, limit=50
+        ):
+            with self._lock:
+                entry = self._entries.get(other)
+            if entry and hamming(hashes["dhash"], entry["dhash"]) <= self.duplicate_distance:
+                return distance, other
+        return None
+
+    def get_status(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "computed": self.computed,
+                "removedSinceCompaction": self._removed,
+                "compactions": self.compactions,
+                "maxDistance": self.max_distance,
+                "duplicateDistance": self.duplicate_distance,
+            }
+
+
+# 全局实例
+template_hashes = ImageHashIndex("templates")
+output_hashes = ImageHashIndex("outputs")
@@ -4,9 +4,24 @@
 """
 
 import os
+import uuid
 from PIL import Image, ImageDraw, ImageFont
 from typing import Optional, Tuple
 
+try:
+    from app.services.font_registry import font_registry
+    from app.services.image_encoder import image_encoder
+    from app.services.text_layout import text_layout
+except ImportError:
+    from services.font_registry import font_registry
+    from services.image_encoder import image_encoder
+    from services.text_layout import text_layout
+
+# 自适应字号的上下限与步长（_fit_text 从大到小尝试）
+FIT_MAX_FONT_SIZE = 40
+FIT_MIN_FONT_SIZE = 16
+FIT_FONT_STEP = 2
+
 
 class ImageProcessor:
     """图片处理器"""
@@ -24,6 +39,8 @@ class ImageProcessor:
         font_size: Optional[int] = None,
         font_color: Tuple[int, int, int] = (0, 0, 0),
         bubble_color: Tuple[int, int, int] = (255, 255, 255),
+        output_dir: Optional[str] = None,
+        output_format: Optional[str] = None,
     ) -> str:
         """
         在图片上添加文字气泡
@@ -35,12 +52,53 @@ class ImageProcessor:
             font_size: 字体大小
             font_color: 字体颜色 (R, G, B)
             bubble_color: 气泡背景颜色 (R, G, B)
+            output_dir: 输出目录（默认与原图同目录）
+            output_format: 输出格式（png / webp / webp_lossless / avif，默认使用服务端配置）
 
         Returns:
             处理后的图片路径
         """
-        # 打开图片
-        image = Image.open(image_path)
+        image = self.draw_text_bubble(
+            Image.open(image_path),
+            text,
+            position=position,
+            font_size=font_size,
+            font_color=font_color,
+            bubble_color=bubble_color,
+        )
+
+        # 保存图片（加随机后缀，同一原图可叠加不同文案）
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        stem = os.path.join(
+            output_dir or os.path.dirname(image_path),
+            f"processed_{name}_{uuid.uuid4().hex[:6]}",
+        )
+        return image_encoder.save(image, stem, output_format)
+
+    def draw_text_bubble(
+        self,
+        image: Image.Image,
+        text: str,
+        position: str = "bottom",
+        font_size: Optional[int] = None,
+        font_color: Tuple[int, int, int] = (0, 0, 0),
+        bubble_color: Tuple[int, int, int] = (255, 255, 255),
+    ) -> Image.Image:
+        """
+        在内存中绘制文字气泡，返回新图片（不修改传入的图片，也不落盘）
+
+        Args:
+            image: 原图
+            text: 要添加的文字
+            position: 气泡位置 ("top", "bottom", "center")
+            font_size: 字体大小
+            font_color: 字体颜色 (R, G, B)
+            bubble_color: 气泡背景颜色 (R, G, B)
+
+        Returns:
+            绘制后的图片
+        """
+        image = image.copy()
         draw = ImageDraw.Draw(image)
 
         # 获取字体
@@ -80,7 +138,7 @@ class ImageProcessor:
         # 绘制文字（支持多行，带描边提升可读性）
         text_x = bubble_x + self.text_padding
         text_y = bubble_y + self.text_padding
-        line_height = self._get_text_height(draw, "测试", font)
+        line_height = self._get_line_height(draw, font)
         for i, line in enumerate(lines):
             y = text_y + i * (line_height + 4)
             draw.text(
@@ -92,43 +150,17 @@ class ImageProcessor:
                 stroke_fill=(255, 255, 255),
             )
 
-        # 保存图片
-        filename = f"processed_{os.path.basename(image_path)}"
-        filepath = os.path.join(
-            os.path.dirname(image_path),
-            filename,
-        )
-        image.save(filepath)
-
-        return filepath
+        return image
 
     def _get_font(self, size: int):
-        """获取字体"""
-        try:
-            # 尝试使用系统字体
-            font_paths = [
-                "/System/Library/Fonts/PingFang.ttc",
-                "/System/Library/Fonts/Hiragino Sans GB.ttc",
-                "/System/Library/Fonts/STHeiti Medium.ttc",
-                "/System/Library/Fonts/Helvetica.ttc",
-                "/System/Library/Fonts/SF Pro.ttc",
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
-                "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-                "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
-                "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
-            ]
-            env_font = os.getenv("MEME_FONT_PATH")
-            if env_font:
-                font_paths.insert(0, env_font)
-            for font_path in font_paths:
-                if os.path.exists(font_path):
-                    return ImageFont.truetype(font_path, size)
-        except Exception:
-            pass
-
-        # 回退到默认字体
-        return ImageFont.load_default()
+        """获取字体（进程内缓存，不再每次查找路径、解析字体文件）"""
+        return font_registry.get(size)
+
+    def preload_fonts(self) -> None:
+        """预加载默认字号与自适应过程中会用到的全部字号"""
+        sizes = set(range(FIT_MIN_FONT_SIZE, FIT_MAX_FONT_SIZE + 1, FIT_FONT_STEP))
+        sizes.add(self.default_font_size)
+        font_registry.preload(sorted(sizes, reverse=True))
 
     def _draw_rounded_rectangle(
         self,
@@ -195,28 +227,19 @@ class ImageProcessor:
         )
 
     def _wrap_text(self, draw, text: str, font: ImageFont.FreeTypeFont, max_width: int):
-        lines = []
-        current = ""
-        for char in text:
-            test = f"{current}{char}"
-            if self._get_text_width(draw, test, font) <= max_width:
-                current = test
-            else:
-                if current:
-                    lines.append(current)
-                current = char
-        if current:
-            lines.append(current)
-        return lines
+        """逐字换行（单遍，字形宽度按字体缓存），断行结果与逐字测量整行一致"""
+        return text_layout.wrap(draw, text, font, max_width)
 
     def _get_text_width(self, draw, text: str, font: ImageFont.FreeTypeFont) -> int:
-        bbox = draw.textbbox((0, 0), text, font=font)
-        return bbox[2] - bbox[0]
+        return text_layout.text_width(draw, text, font)
 
     def _get_text_height(self, draw, text: str, font: ImageFont.FreeTypeFont) -> int:
         bbox = draw.textbbox((0, 0), text, font=font)
         return bbox[3] - bbox[1]
 
+    def _get_line_height(self, draw, font: ImageFont.FreeTypeFont) -> int:
+        return text_layout.line_height(draw, font)
+
     def _fit_text(
         self,
         draw,
@@ -226,21 +249,21 @@ class ImageProcessor:
         max_height: int,
     ):
         size = font.size if hasattr(font, "size") else self.default_font_size
-        size = min(size, 40)
-        while size >= 16:
+        size = min(size, FIT_MAX_FONT_SIZE)
+        while size >= FIT_MIN_FONT_SIZE:
             font = self._get_font(size)
             lines = self._wrap_text(draw, text, font, max_width - self.text_padding * 2)
-            line_height = self._get_text_height(draw, "测试", font)
+            line_height = self._get_line_height(draw, font)
             text_height = len(lines) * line_height + (len(lines) - 1) * 4
             text_width = 0
             for line in lines:
                 text_width = max(text_width, self._get_text_width(draw, line, font))
             if text_width <= max_width and text_height <= max_height:
                 return font, lines, text_width, text_height
-            size -= 2
+            size -= FIT_FONT_STEP
         lines = self._wrap_text(draw, text, font, max_width - self.text_padding * 2)
         text_width = max(self._get_text_width(draw, line, font) for line in lines)
-        text_height = len(lines) * self._get_text_height(draw, "测试", font)
+        text_height = len(lines) * self._get_line_height(draw, font)
         return font, lines, text_width, text_height
 
 
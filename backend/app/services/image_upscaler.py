@@ -2,11 +2,16 @@
 图片超清增强服务（Clipdrop）
 """
 
+import asyncio
 import os
-import uuid
 from typing import Optional
-from io import BytesIO
-import requests
+
+try:
+    from app.services.http_client import http_client
+    from app.services.image_artifact import ImageArtifact
+except ImportError:
+    from services.http_client import http_client
+    from services.image_artifact import ImageArtifact
 
 
 class ClipdropUpscaler:
@@ -22,7 +27,7 @@ class ClipdropUpscaler:
     def is_available(self) -> bool:
         return bool(self.api_key)
 
-    async def upscale(self, image_path: str) -> str:
+    async def upscale(self, image_path: str, output_format: Optional[str] = None) -> str:
         if not self.api_key:
             raise ValueError("CLIPDROP_API_KEY not set")
         if not self.upload_dir:
@@ -37,11 +42,12 @@ class ClipdropUpscaler:
 
         headers = {"x-api-key": self.api_key, "accept": "image/png"}
         with open(image_path, "rb") as f:
-            files = {"image_file": f}
-            data = {"target_width": str(target_width), "target_height": str(target_height)}
-            response = requests.post(
-                self.api_url, headers=headers, files=files, data=data, timeout=180
-            )
+            image_bytes = f.read()
+        files = {"image_file": (os.path.basename(image_path), image_bytes)}
+        data = {"target_width": str(target_width), "target_height": str(target_height)}
+        response = await http_client.post(
+            self.api_url, headers=headers, files=files, data=data, timeout=180
+        )
 
         if response.status_code >= 400:
             body_preview = response.text[:800].replace("\n", " ")
@@ -51,11 +57,10 @@ class ClipdropUpscaler:
         if "image" not in content_type:
             raise Exception(f"Non-image response: {content_type}")
 
-        image = Image.open(BytesIO(response.content))
-        filename = f"upscaled_{uuid.uuid4().hex[:8]}.png"
-        filepath = os.path.join(self.upload_dir, filename)
-        image.save(filepath, "PNG")
-        return filepath
+        artifact = ImageArtifact.from_bytes(response.content)
+        return await asyncio.to_thread(
+            artifact.save, self.upload_dir, "upscaled", output_format
+        )
 
 
 image_upscaler = ClipdropUpscaler()
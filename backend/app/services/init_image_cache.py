@@ -0,0 +1,114 @@
+"""
+img2img 初始图缓存
+- 同一模板的每个变体都要把模板作为 init image 发给 WebUI，
+  这里缓存已缩放、已编码、已 base64 的载荷，只在第一次计算
+- 键为 (模板路径, 修改时间, 大小, 目标尺寸)，模板文件变化后自动失效
+- 可选把模板缩小到 WebUI 工作分辨率（长边上限，对齐到 8 的倍数）并改用 JPEG，默认关闭
+- 按总字节数做 LRU 淘汰
+"""
+
+import base64
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Tuple
+
+from PIL import Image
+
+# (base64 载荷, 宽, 高)
+InitImage = Tuple[str, int, int]
+
+
+class InitImageCache:
+    def __init__(self):
+        # 默认保持原尺寸、无损 PNG，与缓存前发送的载荷一致；缩小 / JPEG 需显式开启
+        self.max_side = int(os.getenv("SD_WEBUI_INIT_MAX_SIDE", "0"))
+        self.format = os.getenv("SD_WEBUI_INIT_FORMAT", "png").strip().lower()
+        if self.format not in ("jpeg", "png"):
+            self.format = "png"
+        self.jpeg_quality = int(os.getenv("SD_WEBUI_INIT_JPEG_QUALITY", "95"))
+        self.max_bytes = int(os.getenv("INIT_IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+        self._entries: "OrderedDict[tuple, InitImage]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _target_size(self, width: int, height: int) -> Tuple[int, int]:
+        longest = max(width, height)
+        if self.max_side <= 0 or longest <= self.max_side:
+            return width, height
+        scale = self.max_side / longest
+        # SD 的宽高需为 8 的倍数
+        return (
+            max(64, int(width * scale) // 8 * 8),
+            max(64, int(height * scale) // 8 * 8),
+        )
+
+    def _encode(self, image_path: str) -> InitImage:
+        with Image.open(image_path) as image:
+            width, height = self._target_size(*image.size)
+            if (width, height) != image.size:
+                image.draft("RGB", (width, height))
+            image = image.convert("RGB")
+            if (width, height) != image.size:
+                image = image.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+            buffer = BytesIO()
+            if self.format == "png":
+                image.save(buffer, format="PNG")
+            else:
+                image.save(buffer, format="JPEG", quality=self.jpeg_quality)
+        return base64.b64encode(buffer.getvalue()).decode("utf-8"), width, height
+
+    def get(self, image_path: str) -> InitImage:
+        """返回 (base64 载荷, 宽, 高)（阻塞调用，异步环境中放到线程池）"""
+        stat = os.stat(image_path)
+        key = (
+            os.path.abspath(image_path),
+            stat.st_mtime_ns,
+            stat.st_size,
+            self.max_side,
+            self.format,
+        )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._encode(image_path)
+        size = len(entry[0])
+        if size > self.max_bytes:
+            return entry
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[0])
+                self.evictions += 1
+        return entry
+
+    def get_status(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "maxSide": self.max_side,
+                "format": self.format,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# 全局实例
+init_image_cache = InitImageCache()
@@ -0,0 +1,173 @@
+"""
+异步生成任务
+- 提交后立即返回任务 ID，由进程内有界 worker 池执行
+- 记录阶段事件（提示词优化、提供方尝试、变体完成、后处理等），支持 SSE 订阅
+- 已结束的任务按 TTL 清理
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+EmitFn = Callable[[str, Dict[str, Any]], None]
+JobRunner = Callable[[EmitFn], Awaitable[Any]]
+
+TERMINAL_STAGES = {"completed", "failed"}
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    status: str = "queued"  # queued | running | succeeded | failed
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    listeners: Set[asyncio.Queue] = field(default_factory=set, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "createdAt": self.created_at,
+            "updatedAt": self.updated_at,
+            "events": self.events,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    def __init__(self):
+        self.worker_count = max(1, int(os.getenv("GENERATION_JOB_WORKERS", "4")))
+        self.queue_size = max(1, int(os.getenv("GENERATION_JOB_QUEUE_SIZE", "100")))
+        self.job_ttl = int(os.getenv("GENERATION_JOB_TTL", "3600"))
+        self.heartbeat_interval = 15.0
+        self.jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        print(
+            f"📮 JobManager initialized (workers={self.worker_count}, queue={self.queue_size})"
+        )
+
+    def _ensure_workers(self) -> asyncio.Queue:
+        # 延迟启动：worker 需要运行中的事件循环
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [task for task in self._workers if not task.done()]
+        while len(self._workers) < self.worker_count:
+            self._workers.append(asyncio.create_task(self._worker()))
+        return self._queue
+
+    def _prune(self) -> None:
+        if self.job_ttl <= 0:
+            return
+        now = time.time()
+        expired = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.status in {"succeeded", "failed"} and now - job.updated_at > self.job_ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def submit(self, runner: JobRunner) -> Job:
+        """提交任务，队列已满时抛出 JobQueueFullError"""
+        self._prune()
+        queue = self._ensure_workers()
+        job = Job(id=uuid.uuid4().hex)
+        try:
+            queue.put_nowait((job, runner))
+        except asyncio.QueueFull:
+            raise JobQueueFullError("Generation queue is full, please retry later")
+        self.jobs[job.id] = job
+        self.emit(job, "queued", {"position": queue.qsize()})
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def emit(self, job: Job, stage: str, data: Optional[Dict[str, Any]] = None) -> None:
+        event = {
+            "seq": len(job.events) + 1,
+            "stage": stage,
+            "data": data or {},
+            "at": time.time(),
+        }
+        job.events.append(event)
+        job.updated_at = event["at"]
+        for listener in list(job.listeners):
+            listener.put_nowait(event)
+
+    async def stream_events(self, job: Job) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        回放历史事件并持续推送新事件，直到任务结束
+
+        长时间无事件时产出 None，供调用方发送心跳
+        """
+        listener: asyncio.Queue = asyncio.Queue()
+        job.listeners.add(listener)
+        try:
+            last_seq = 0
+            for event in list(job.events):
+                last_seq = event["seq"]
+                yield event
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+            while True:
+                try:
+                    event = await asyncio.wait_for(listener.get(), self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event["seq"] <= last_seq:
+                    continue
+                last_seq = event["seq"]
+                yield event
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+        finally:
+            job.listeners.discard(listener)
+
+    async def _worker(self) -> None:
+        queue = self._queue
+        while True:
+            job, runner = await queue.get()
+            try:
+                job.status = "running"
+                self.emit(job, "started")
+                job.result = await runner(lambda stage, data=None: self.emit(job, stage, data))
+                job.status = "succeeded"
+                self.emit(job, "completed", {"result": job.result})
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Cancelled"
+                self.emit(job, "failed", {"error": job.error})
+                raise
+            except Exception as e:
+                print(f"⚠️ Generation job {job.id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+                self.emit(job, "failed", {"error": job.error})
+            finally:
+                queue.task_done()
+
+    async def shutdown(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+
+# 全局实例
+job_manager = JobManager()
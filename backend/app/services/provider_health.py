@@ -0,0 +1,187 @@
+"""
+提供方健康统计
+- 记录每个提供方最近若干次调用的耗时与成败
+- 提供耗时分位数，用于对冲请求（hedging）的触发时机
+- EWMA 耗时 / 错误率 + 熔断器（closed / open / half_open）
+- 根据上述统计动态调整提供方尝试顺序
+"""
+
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却期后放行一次试探请求"""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = max(0.0, cooldown)
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.open_count = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def is_open(self) -> bool:
+        state = self.state
+        return state == "open" or (state == "half_open" and self.trial_in_flight)
+
+    def acquire(self) -> bool:
+        """请求放行；half_open 状态下同一时间只放行一个试探请求"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """试探请求被取消（未产生结果）时归还名额"""
+        self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        was_trial = self.trial_in_flight
+        self.trial_in_flight = False
+        if was_trial or self.consecutive_failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.open_count += 1
+            self.opened_at = time.monotonic()
+
+
+class ProviderStats:
+    def __init__(self, window: int, alpha: float, breaker: CircuitBreaker):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.alpha = alpha
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error_rate = 0.0
+        self.breaker = breaker
+
+    def record(self, latency: float, success: bool) -> None:
+        self.ewma_error_rate += self.alpha * ((0.0 if success else 1.0) - self.ewma_error_rate)
+        if success:
+            self.successes += 1
+            self.latencies.append(latency)
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency += self.alpha * (latency - self.ewma_latency)
+            self.breaker.record_success()
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        rank = max(0, min(len(ordered) - 1, math.ceil(pct * len(ordered)) - 1))
+        return ordered[rank]
+
+
+class ProviderHealth:
+    def __init__(self):
+        self.window = max(1, int(os.getenv("PROVIDER_LATENCY_WINDOW", "50")))
+        self.alpha = min(1.0, max(0.01, float(os.getenv("PROVIDER_EWMA_ALPHA", "0.3"))))
+        self.breaker_failures = int(os.getenv("PROVIDER_BREAKER_FAILURES", "3"))
+        self.breaker_cooldown = float(os.getenv("PROVIDER_BREAKER_COOLDOWN", "60"))
+        # 错误率高于该值的提供方排到健康提供方之后
+        self.degraded_error_rate = float(os.getenv("PROVIDER_DEGRADED_ERROR_RATE", "0.5"))
+        self._stats: Dict[str, ProviderStats] = {}
+
+    def _get(self, provider: str) -> ProviderStats:
+        stats = self._stats.get(provider)
+        if stats is None:
+            breaker = CircuitBreaker(self.breaker_failures, self.breaker_cooldown)
+            stats = ProviderStats(self.window, self.alpha, breaker)
+            self._stats[provider] = stats
+        return stats
+
+    def record(self, provider: str, latency: float, success: bool) -> None:
+        self._get(provider).record(latency, success)
+
+    def acquire(self, provider: str) -> bool:
+        return self._get(provider).breaker.acquire()
+
+    def release(self, provider: str) -> None:
+        self._get(provider).breaker.release()
+
+    def is_open(self, provider: str) -> bool:
+        stats = self._stats.get(provider)
+        return bool(stats and stats.breaker.is_open())
+
+    def latency_percentile(
+        self, provider: str, pct: float, min_samples: int = 1
+    ) -> Optional[float]:
+        """成功调用耗时的分位数；样本不足时返回 None"""
+        stats = self._stats.get(provider)
+        if stats is None or len(stats.latencies) < max(1, min_samples):
+            return None
+        return stats.percentile(pct)
+
+    def rank(self, providers: List[str]) -> List[str]:
+        """
+        按健康度重排提供方：
+        健康 → 降级（高错误率 / 半开试探）→ 熔断；同一档内按 EWMA 耗时升序，
+        没有样本的提供方保持配置顺序排在同档末尾
+        """
+
+        def _key(item):
+            position, provider = item
+            stats = self._stats.get(provider)
+            if stats is None:
+                return (0, math.inf, position)
+            state = stats.breaker.state
+            if state == "open":
+                tier = 2
+            elif state == "half_open" or stats.ewma_error_rate >= self.degraded_error_rate:
+                tier = 1
+            else:
+                tier = 0
+            latency = stats.ewma_latency if stats.ewma_latency is not None else math.inf
+            return (tier, latency, position)
+
+        return [provider for _, provider in sorted(enumerate(providers), key=_key)]
+
+    def get_status(self) -> Dict[str, Dict[str, object]]:
+        status = {}
+        for provider, stats in self._stats.items():
+            status[provider] = {
+                "state": stats.breaker.state,
+                "consecutiveFailures": stats.breaker.consecutive_failures,
+                "openCount": stats.breaker.open_count,
+                "successes": stats.successes,
+                "failures": stats.failures,
+                "ewmaLatency": stats.ewma_latency,
+                "ewmaErrorRate": round(stats.ewma_error_rate, 4),
+                "samples": len(stats.latencies),
+                "p50": stats.percentile(0.5),
+                "p90": stats.percentile(0.9),
+            }
+        return status
+
+
+# 全局实例
+provider_health = ProviderHealth()
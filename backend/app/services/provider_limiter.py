@@ -0,0 +1,173 @@
+"""
+提供方限流
+- 每个提供方独立的并发上限（信号量，默认不限制，按需开启）
+- 令牌桶限速，突发请求短暂排队而不是直接打到提供方换来 429
+- 默认一直排队；配置了最长等待时间且超时时抛出 ProviderBusyError，
+  由接口返回 429，不会转向其它提供方或 mock
+- 记录令牌数、排队深度、等待耗时，供监控查看
+"""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+
+class ProviderBusyError(Exception):
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _env_number(names, default: float) -> float:
+    for name in names:
+        value = os.getenv(name)
+        if value not in (None, ""):
+            return float(value)
+    return default
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # 每秒补充的令牌数
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        # 持锁等待，保证排队请求按先后顺序拿到令牌
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def available(self) -> float:
+        self._refill()
+        return round(self.tokens, 2)
+
+
+class LimiterState:
+    def __init__(self, max_concurrency: int, rate_per_minute: float, burst: float):
+        self.max_concurrency = max_concurrency
+        self.rate_per_minute = rate_per_minute
+        self.bucket = (
+            TokenBucket(rate_per_minute / 60.0, burst or max(1.0, rate_per_minute / 60.0))
+            if rate_per_minute > 0
+            else None
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    @property
+    def semaphore(self) -> Optional[asyncio.Semaphore]:
+        """并发上限为 0 时不限制并发"""
+        if self.max_concurrency <= 0:
+            return None
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+
+class ProviderLimiter:
+    def __init__(self):
+        # 默认不限并发、不限速、排队不超时：限流只在显式配置后生效
+        self.default_concurrency = int(os.getenv("PROVIDER_MAX_CONCURRENCY", "0"))
+        self.default_rate = float(os.getenv("PROVIDER_RATE_PER_MINUTE", "0"))
+        self.max_wait = float(os.getenv("PROVIDER_LIMIT_MAX_WAIT", "0"))
+        self._states: Dict[str, LimiterState] = {}
+
+    def _get(self, provider: str) -> LimiterState:
+        state = self._states.get(provider)
+        if state is None:
+            prefix = provider.upper()
+            concurrency = int(
+                _env_number([f"{prefix}_MAX_CONCURRENCY"], self.default_concurrency)
+            )
+            rate = _env_number([f"{prefix}_RATE_PER_MINUTE"], self.default_rate)
+            burst = _env_number([f"{prefix}_RATE_BURST", "PROVIDER_RATE_BURST"], 0)
+            state = LimiterState(max(0, concurrency), max(0.0, rate), max(0.0, burst))
+            self._states[provider] = state
+        return state
+
+    async def _acquire(self, state: LimiterState) -> None:
+        semaphore = state.semaphore
+        if semaphore is not None:
+            await semaphore.acquire()
+        if state.bucket is None:
+            return
+        try:
+            await state.bucket.acquire()
+        except BaseException:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, provider: str) -> AsyncIterator[None]:
+        """占用提供方的一个并发槽位和一个令牌；配置了 max_wait 且等待超时时抛出 ProviderBusyError"""
+        state = self._get(provider)
+        started = time.monotonic()
+        state.waiting += 1
+        try:
+            if self.max_wait > 0:
+                await asyncio.wait_for(self._acquire(state), self.max_wait)
+            else:
+                await self._acquire(state)
+        except asyncio.TimeoutError:
+            state.rejected += 1
+            raise ProviderBusyError(
+                f"{provider} is busy (queued for {self.max_wait:g}s), please retry later",
+                retry_after=self.max_wait,
+            )
+        finally:
+            state.waiting -= 1
+
+        waited = time.monotonic() - started
+        state.acquired += 1
+        state.total_wait += waited
+        state.max_wait_seen = max(state.max_wait_seen, waited)
+        if waited >= 0.5:
+            print(f"⏳ {provider} queued for {waited:.1f}s")
+        state.active += 1
+        try:
+            yield
+        finally:
+            state.active -= 1
+            if state.semaphore is not None:
+                state.semaphore.release()
+
+    def get_status(self) -> Dict[str, object]:
+        providers = {}
+        for provider, state in self._states.items():
+            providers[provider] = {
+                "maxConcurrency": state.max_concurrency,
+                "ratePerMinute": state.rate_per_minute,
+                "tokens": state.bucket.available() if state.bucket else None,
+                "active": state.active,
+                "waiting": state.waiting,
+                "acquired": state.acquired,
+                "rejected": state.rejected,
+                "avgWait": round(state.total_wait / state.acquired, 4) if state.acquired else 0.0,
+                "maxWait": round(state.max_wait_seen, 4),
+            }
+        return {"maxWait": self.max_wait, "providers": providers}
+
+
+# 全局实例
+provider_limiter = ProviderLimiter()
@@ -0,0 +1,80 @@
+"""
+生成请求合并（single-flight）
+- 相同生成参数的并发请求只触发一次提供方调用
+- 后到的请求等待同一个进行中的任务并共享其结果
+- 进行中的阶段事件广播给所有等待者，后到者先收到一条 coalesced 事件
+- 任务完成后立即移除，之后的相同请求会重新生成
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# (阶段, 数据)，与 image_generator.ProgressCallback 相同
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class RequestCoalescer:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # 合并键 → 当前等待者的事件回调
+        self._listeners: Dict[str, List[EventCallback]] = {}
+
+    def build_key(self, **params) -> str:
+        """根据规范化后的生成参数构建合并键"""
+        canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def run(
+        self,
+        key: str,
+        factory: Callable[[EventCallback], Awaitable[T]],
+        on_event: Optional[EventCallback] = None,
+    ) -> T:
+        """
+        执行或加入一个进行中的生成任务
+
+        factory 接收一个事件回调，发出的事件会转发给此刻所有等待者的 on_event；
+        返回的结果对象会被所有等待者共享，调用方不应原地修改
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            print(f"🔗 Coalesced duplicate generation ({key[:8]})")
+            listeners = self._listeners[key]
+            if on_event:
+                on_event("coalesced", {})
+        else:
+            listeners = self._listeners[key] = []
+            task = asyncio.ensure_future(
+                factory(lambda stage, data: self._broadcast(listeners, stage, data))
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._on_done(key, done))
+
+        if on_event:
+            listeners.append(on_event)
+        try:
+            # shield：某个等待者被取消（如客户端断开）时不影响其它等待者
+            return await asyncio.shield(task)
+        finally:
+            if on_event in listeners:
+                listeners.remove(on_event)
+
+    def _broadcast(self, listeners: List[EventCallback], stage: str, data: Dict[str, Any]) -> None:
+        for listener in list(listeners):
+            listener(stage, data)
+
+    def _on_done(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._listeners.pop(key, None)
+        if not task.cancelled():
+            # 标记异常已读取，避免无人等待时出现 "exception was never retrieved"
+            task.exception()
+
+
+# 全局实例
+request_coalescer = RequestCoalescer()
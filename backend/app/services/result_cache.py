@@ -0,0 +1,265 @@
+"""
+生成结果缓存（内容寻址，落盘）
+- 以 (优化后提示词, 风格, 提供方, 尺寸, seed, 变体序号, 模板) 的哈希为键
+- 命中时直接返回磁盘上的图片，不再调用提供方
+- 按总字节数和条目年龄做 LRU 淘汰，并统计命中/未命中次数
+- 索引读写加锁，可在线程池中调用；索引文件按间隔批量落盘，不在每次写入时重写
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+class GenerationCache:
+    def __init__(self, cache_dir: Optional[str] = None):
+        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        project_root = os.path.dirname(backend_dir)
+        static_dir = os.path.join(project_root, "static")
+        self.cache_dir = cache_dir or os.getenv("GENERATION_CACHE_DIR") or os.path.join(
+            static_dir, "cache"
+        )
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.enabled = _env_flag("GENERATION_CACHE_ENABLED", True)
+        self.max_bytes = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.max_age = int(os.getenv("GENERATION_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+        self.index_flush_interval = 10.0
+        # 按年龄过期的全量扫描间隔（容量淘汰每次写入都做，只从 LRU 头部弹出）
+        self.expiry_scan_interval = 60.0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._dirty = False
+        self._last_flush = 0.0
+        self._last_expiry_scan = 0.0
+        self._lock = threading.Lock()
+        # 串行化索引文件写入，避免并发刷盘共用同一个临时文件
+        self._flush_lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+            print(
+                f"🗄️ GenerationCache initialized ({len(self._entries)} entries, max={self.max_bytes} bytes)"
+            )
+        else:
+            print("🗄️ GenerationCache disabled (GENERATION_CACHE_ENABLED=false)")
+
+    def build_key(self, **params) -> str:
+        canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        if not isinstance(data, list):
+            return
+        # 按最近访问时间升序载入，OrderedDict 头部即最久未使用
+        for entry in sorted(data, key=lambda item: item.get("lastAccess", 0)):
+            path = os.path.join(self.cache_dir, entry.get("filename", ""))
+            if not entry.get("key") or not os.path.isfile(path):
+                continue
+            self._entries[entry["key"]] = entry
+            self.total_bytes += int(entry.get("size", 0))
+
+    def flush(self) -> None:
+        """把索引写入磁盘（阻塞调用）"""
+        if not self.enabled:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = [dict(entry) for entry in self._entries.values()]
+                self._dirty = False
+                self._last_flush = time.time()
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+
+    def _maybe_flush(self) -> None:
+        if self._dirty and time.time() - self._last_flush > self.index_flush_interval:
+            self.flush()
+
+    def _pop(self, key: str) -> Optional[Dict]:
+        """从索引移除条目（需持有 _lock），返回被移除的条目，文件由调用方在锁外删除"""
+        entry = self._entries.pop(key, None)
+        if not entry:
+            return None
+        self.total_bytes -= int(entry.get("size", 0))
+        self.evictions += 1
+        self._dirty = True
+        return entry
+
+    def _delete_files(self, entries: List[Dict], keep: Optional[str] = None) -> None:
+        for entry in entries:
+            if entry["filename"] == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, entry["filename"]))
+            except OSError:
+                pass
+
+    def _evict(self) -> List[Dict]:
+        """需持有 _lock；返回被淘汰的条目"""
+        evicted = []
+        now = time.time()
+        if self.max_age > 0 and now - self._last_expiry_scan > self.expiry_scan_interval:
+            self._last_expiry_scan = now
+            expired = [
+                key
+                for key, entry in self._entries.items()
+                if now - entry.get("createdAt", now) > self.max_age
+            ]
+            evicted.extend(self._pop(key) for key in expired)
+        while self.max_bytes > 0 and self.total_bytes > self.max_bytes and self._entries:
+            evicted.append(self._pop(next(iter(self._entries))))
+        return evicted
+
+    def get(self, key: str) -> Optional[Dict]:
+        """查找缓存，命中时返回 {"path", "provider"}（阻塞调用）"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            filename = entry["filename"]
+            expired = self.max_age > 0 and time.time() - entry.get("createdAt", 0) > self.max_age
+
+        path = os.path.join(self.cache_dir, filename)
+        if expired or not os.path.isfile(path):
+            with self._lock:
+                stale = self._pop(key) if self._entries.get(key) is entry else None
+                self.misses += 1
+            if stale:
+                self._delete_files([stale])
+            return None
+
+        with self._lock:
+            self.hits += 1
+            entry["lastAccess"] = time.time()
+            entry["hits"] = int(entry.get("hits", 0)) + 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._dirty = True
+            provider = entry.get("provider", "unknown")
+        self._maybe_flush()
+        return {"path": path, "provider": provider}
+
+    def put(self, key: str, source_path: str, provider: str) -> Optional[str]:
+        """把生成结果放入缓存（优先硬链接，避免重复占用磁盘；阻塞调用）"""
+        if not self.enabled or not os.path.isfile(source_path):
+            return None
+
+        ext = os.path.splitext(source_path)[1] or ".png"
+        filename = f"gen_{key[:32]}{ext}"
+        target_path = os.path.join(self.cache_dir, filename)
+        self._discard(key, filename)
+        try:
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            try:
+                os.link(source_path, target_path)
+            except OSError:
+                shutil.copyfile(source_path, target_path)
+        except OSError as e:
+            print(f"⚠️ Generation cache write failed: {e}")
+            return None
+
+        self._register(key, filename, provider)
+        return target_path
+
+    def put_artifact(self, key: str, artifact, provider: str) -> Optional[str]:
+        """
+        缓存内存中的生成结果：直接写入缓存目录（原始字节原样写入，否则编码一次），
+        之后该 artifact 再落盘时改为从缓存文件硬链接，不重复编码（阻塞调用，可能编码图片）
+        """
+        if not self.enabled:
+            return None
+        if artifact.path:
+            return self.put(key, artifact.path, provider)
+
+        filename = f"gen_{key[:32]}{artifact.extension_for('auto')}"
+        target_path = os.path.join(self.cache_dir, filename)
+        self._discard(key, filename)
+        try:
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            artifact.save_as(target_path, "auto")
+        except OSError as e:
+            print(f"⚠️ Generation cache write failed: {e}")
+            return None
+        self._register(key, filename, provider)
+        return target_path
+
+    def _discard(self, key: str, filename: str) -> None:
+        """覆盖写入前移除旧条目；与新文件同名的旧文件由写入方覆盖，不在这里删除"""
+        with self._lock:
+            old = self._pop(key)
+        if old:
+            self._delete_files([old], keep=filename)
+
+    def _register(self, key: str, filename: str, provider: str) -> None:
+        now = time.time()
+        size = os.path.getsize(os.path.join(self.cache_dir, filename))
+        with self._lock:
+            # 并发写入同一个键时以后写入者为准
+            replaced = self._entries.pop(key, None)
+            if replaced:
+                self.total_bytes -= int(replaced.get("size", 0))
+            self._entries[key] = {
+                "key": key,
+                "filename": filename,
+                "provider": provider,
+                "size": size,
+                "createdAt": now,
+                "lastAccess": now,
+                "hits": 0,
+            }
+            self.total_bytes += size
+            evicted = self._evict()
+        if replaced:
+            self._delete_files([replaced], keep=filename)
+        self._delete_files(evicted)
+        self._maybe_flush()
+
+    def get_status(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "maxBytes": self.max_bytes,
+                "maxAge": self.max_age,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+# 全局实例
+generation_cache = GenerationCache()
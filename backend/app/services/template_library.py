@@ -3,16 +3,41 @@
 - 本地内置模板
 - 支持从 Imgflip 拉取热梗模板
 - 支持传入任意图片 URL 下载为本地模板（仅本地演示用途）
+- 同步时有限并发下载（复用共享连接池），正文流式写入临时文件；
+  已有模板发送条件请求，未变化时只需一次 304；每轮同步只写一次远程索引
+- 模板索引常驻内存：按 id 直接查找；通过模板目录与远程索引文件的修改时间检测变化，
+  同步后立即重建
+- 模板感知哈希索引：同步时丢弃与已有模板几乎相同的新模板，并支持相似模板查询
 """
 
+import asyncio
 import hashlib
 import json
 import os
 import re
-from typing import List, Dict, Optional
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from typing import List, Dict, Optional, Tuple
 from urllib.parse import urlparse
 
-import requests
+try:
+    from app.services.http_client import http_client
+    from app.services.image_hash import template_hashes
+except ImportError:
+    from services.http_client import http_client
+    from services.image_hash import template_hashes
+
+# 流式下载时攒够这么多字节才写一次盘
+DOWNLOAD_FLUSH_BYTES = 1024 * 1024
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
 
 
 class TemplateLibrary:
@@ -25,6 +50,17 @@ class TemplateLibrary:
 
         self.remote_index_path = os.path.join(self.template_dir, "remote_index.json")
         self.remote_index = self._load_remote_index()
+        self.sync_concurrency = max(1, int(os.getenv("TEMPLATE_SYNC_CONCURRENCY", "6")))
+        self.dedupe = _env_flag("TEMPLATE_DEDUPE", True)
+        self._hashed_version = -1
+
+        # 内存索引：id → 模板信息（仅包含文件存在的模板，按列表顺序）
+        self.index_check_interval = float(os.getenv("TEMPLATE_INDEX_CHECK_INTERVAL", "2"))
+        self._index: Dict[str, Dict[str, str]] = {}
+        self._signature: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._index_lock = threading.Lock()
+        self.version = 0
 
         # 本地默认模板（已存在于 static/templates 下）
         self.templates: List[Dict[str, str]] = [
@@ -87,6 +123,72 @@ class TemplateLibrary:
     def _save_remote_index(self):
         with open(self.remote_index_path, "w", encoding="utf-8") as f:
             json.dump(self.remote_index, f, ensure_ascii=False, indent=2)
+        self.invalidate()
+
+    def _stat_signature(self) -> Tuple[int, int]:
+        """模板目录（增删文件）与远程索引文件（内容变化）的修改时间"""
+        dir_mtime = os.stat(self.template_dir).st_mtime_ns
+        try:
+            index_mtime = os.stat(self.remote_index_path).st_mtime_ns
+        except FileNotFoundError:
+            index_mtime = 0
+        return dir_mtime, index_mtime
+
+    def invalidate(self) -> None:
+        """下次访问时重新检查并重建索引"""
+        with self._index_lock:
+            self._signature = None
+            self._checked_at = 0.0
+
+    def _ensure_index(self) -> None:
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < self.index_check_interval:
+            return
+        with self._index_lock:
+            if self._signature is not None and now - self._checked_at < self.index_check_interval:
+                return
+            signature = self._stat_signature()
+            self._checked_at = now
+            if signature == self._signature:
+                return
+            if self._signature is not None and signature[1] != self._signature[1]:
+                # 远程索引被其它进程修改
+                self.remote_index = self._load_remote_index()
+            self._rebuild_index()
+            self._signature = signature
+
+    def get_version(self) -> int:
+        """当前模板索引版本（检查变化后返回），模板增删或同步后递增"""
+        self._ensure_index()
+        return self.version
+
+    def _rebuild_index(self) -> None:
+        existing = set(os.listdir(self.template_dir))
+        index: Dict[str, Dict[str, str]] = {}
+        for template in self.templates:
+            if template["filename"] not in existing or template["id"] in index:
+                continue
+            index[template["id"]] = {
+                "id": template["id"],
+                "name": template["name"],
+                "filename": template["filename"],
+                "sourceUrl": template["sourceUrl"],
+                "license": template["license"],
+            }
+        for template in self.remote_index:
+            filename = template.get("filename")
+            template_id = template.get("id")
+            if not filename or not template_id or filename not in existing or template_id in index:
+                continue
+            index[template_id] = {
+                "id": template_id,
+                "name": template.get("name", template_id),
+                "filename": filename,
+                "sourceUrl": template.get("sourceUrl", ""),
+                "license": template.get("license", "Demo Only"),
+            }
+        self._index = index
+        self.version += 1
 
     def _guess_ext(self, url: str, content_type: str = "") -> str:
         parsed = urlparse(url)
@@ -107,141 +209,269 @@ class TemplateLibrary:
         value = re.sub(r"\s+", " ", value)
         return value[:48]
 
-    def _download_image(self, url: str, target_path: str, timeout: int = 30) -> None:
-        response = requests.get(url, timeout=timeout)
-        response.raise_for_status()
-        content_type = (response.headers.get("Content-Type") or "").lower()
-        if content_type and "image" not in content_type:
-            raise ValueError(f"URL is not an image: {content_type}")
-
-        with open(target_path, "wb") as f:
-            f.write(response.content)
-
-    def _upsert_remote_template(
+    async def _download_image(
         self,
-        template_id: str,
-        name: str,
-        filename: str,
-        source_url: str,
-    ) -> None:
-        for idx, item in enumerate(self.remote_index):
-            if item.get("id") == template_id:
-                self.remote_index[idx] = {
-                    "id": template_id,
-                    "name": name,
-                    "filename": filename,
-                    "sourceUrl": source_url,
-                    "license": "Demo Only",
-                }
-                self._save_remote_index()
-                return
-
-        self.remote_index.append(
-            {
-                "id": template_id,
-                "name": name,
-                "filename": filename,
-                "sourceUrl": source_url,
-                "license": "Demo Only",
+        url: str,
+        target_path: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: int = 30,
+    ) -> Optional[Dict[str, str]]:
+        """
+        流式下载到临时文件后原子替换 target_path 的扩展名版本
+
+        返回 None 表示 304 未修改；否则返回 {"path", "etag", "lastModified"}
+        """
+        async with http_client.stream("GET", url, headers=headers, timeout=timeout) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            content_type = (response.headers.get("Content-Type") or "").lower()
+            if content_type and "image" not in content_type:
+                raise ValueError(f"URL is not an image: {content_type}")
+
+            path = f"{target_path}{self._guess_ext(url, content_type)}"
+            # 每次下载独占一个临时文件，同一模板并发下载时互不覆盖
+            f = await asyncio.to_thread(
+                tempfile.NamedTemporaryFile,
+                dir=os.path.dirname(path) or ".",
+                prefix=f"{os.path.basename(path)}.",
+                suffix=".tmp",
+                delete=False,
+            )
+            tmp_path = f.name
+            try:
+                # 分块攒满 DOWNLOAD_FLUSH_BYTES 再交给线程写盘，文件 I/O 不占用事件循环
+                buffer: List[bytes] = []
+                buffered = 0
+                async for chunk in response.aiter_bytes(64 * 1024):
+                    buffer.append(chunk)
+                    buffered += len(chunk)
+                    if buffered >= DOWNLOAD_FLUSH_BYTES:
+                        await asyncio.to_thread(f.write, b"".join(buffer))
+                        buffer, buffered = [], 0
+                if buffer:
+                    await asyncio.to_thread(f.write, b"".join(buffer))
+                await asyncio.to_thread(f.close)
+                await asyncio.to_thread(os.replace, tmp_path, path)
+            except BaseException:
+                f.close()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            return {
+                "path": path,
+                "etag": response.headers.get("ETag", ""),
+                "lastModified": response.headers.get("Last-Modified", ""),
             }
-        )
+
+    def _commit_remote_templates(self, entries: List[Dict[str, str]]) -> None:
+        """把一次同步的结果合并进远程索引并只写一次文件"""
+        if not entries:
+            return
+        positions = {item.get("id"): idx for idx, item in enumerate(self.remote_index)}
+        for entry in entries:
+            idx = positions.get(entry["id"])
+            if idx is None:
+                positions[entry["id"]] = len(self.remote_index)
+                self.remote_index.append(entry)
+            else:
+                self.remote_index[idx] = entry
         self._save_remote_index()
 
-    def _download_remote_template(
+    async def _download_remote_template(
         self,
         template_id: str,
         name: str,
         source_url: str,
         force: bool = False,
-    ) -> str:
+    ) -> Tuple[str, Optional[Dict[str, str]]]:
+        """
+        下载单个远程模板，返回 (结果, 新的索引条目)
+
+        已存在的模板发送条件请求（ETag / Last-Modified，旧条目使用文件修改时间），
+        未变化时服务端返回 304，不再下载正文
+        """
         existing = None
         for item in self.remote_index:
             if item.get("id") == template_id:
                 existing = item
                 break
 
-        if existing and not force:
-            path = os.path.join(self.template_dir, existing["filename"])
-            if os.path.exists(path):
-                return "skipped"
-
-        head = requests.head(source_url, timeout=15, allow_redirects=True)
-        content_type = (head.headers.get("Content-Type") or "").lower()
-        ext = self._guess_ext(source_url, content_type)
-        filename = f"remote_{template_id}{ext}"
-        path = os.path.join(self.template_dir, filename)
-
-        self._download_image(source_url, path)
-        self._upsert_remote_template(template_id, name, filename, source_url)
-        return "added"
-
-    def list_templates(self) -> List[Dict[str, str]]:
-        items = []
-
-        for template in self.templates:
-            path = os.path.join(self.template_dir, template["filename"])
-            if not os.path.exists(path):
-                continue
-            items.append(
-                {
-                    "id": template["id"],
-                    "name": template["name"],
-                    "previewUrl": f"/static/templates/{template['filename']}",
-                    "sourceUrl": template["sourceUrl"],
-                    "license": template["license"],
-                }
+        headers: Dict[str, str] = {}
+        old_path = None
+        if existing and existing.get("filename"):
+            old_path = os.path.join(self.template_dir, existing["filename"])
+            if not os.path.exists(old_path):
+                old_path = None
+        if old_path and not force:
+            if existing.get("etag"):
+                headers["If-None-Match"] = existing["etag"]
+            headers["If-Modified-Since"] = existing.get("lastModified") or formatdate(
+                os.path.getmtime(old_path), usegmt=True
             )
 
-        for template in self.remote_index:
-            filename = template.get("filename")
-            if not filename:
+        result = await self._download_image(
+            source_url,
+            os.path.join(self.template_dir, f"remote_{template_id}"),
+            headers=headers,
+        )
+        if result is None:
+            return "skipped", None
+
+        filename = os.path.basename(result["path"])
+        if old_path and os.path.basename(old_path) != filename:
+            # 扩展名变化时清理旧文件
+            os.remove(old_path)
+        entry = {
+            "id": template_id,
+            "name": name,
+            "filename": filename,
+            "sourceUrl": source_url,
+            "license": "Demo Only",
+        }
+        if result["etag"]:
+            entry["etag"] = result["etag"]
+        if result["lastModified"]:
+            entry["lastModified"] = result["lastModified"]
+        return ("updated" if existing else "added"), entry
+
+    async def _sync_remote_templates(
+        self, jobs: List[Tuple[str, str, str]], force: bool, source: str
+    ) -> Dict[str, int]:
+        """并发下载 (template_id, name, url) 列表，整轮结束后提交一次索引"""
+        jobs = list({job[0]: job for job in jobs}.values())
+        semaphore = asyncio.Semaphore(self.sync_concurrency)
+        counts = {"added": 0, "updated": 0, "skipped": 0, "duplicates": 0, "failed": 0}
+        results: Dict[str, Tuple[str, Dict[str, str]]] = {}
+
+        async def _run(template_id: str, name: str, url: str) -> None:
+            async with semaphore:
+                try:
+                    result, entry = await self._download_remote_template(
+                        template_id=template_id,
+                        name=name,
+                        source_url=url,
+                        force=force,
+                    )
+                except Exception as e:
+                    print(f"⚠️ Sync {source} template failed ({template_id}): {e}")
+                    counts["failed"] += 1
+                    return
+            counts[result] += 1
+            if entry:
+                results[template_id] = (result, entry)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(_run(*job) for job in jobs))
+        # 按请求顺序提交，保证去重结果稳定
+        ordered = [results[job[0]] for job in jobs if job[0] in results]
+        entries = [entry for _, entry in ordered]
+        if self.dedupe:
+            added = [entry for result, entry in ordered if result == "added"]
+            duplicates = await asyncio.to_thread(self._drop_duplicates, added)
+            counts["added"] -= len(duplicates)
+            counts["duplicates"] = len(duplicates)
+            entries = [entry for entry in entries if entry["id"] not in duplicates]
+        self._commit_remote_templates(entries)
+        print(
+            f"🔄 Synced {len(jobs)} {source} templates in {time.perf_counter() - started:.2f}s "
+            f"(added={counts['added']}, updated={counts['updated']}, skipped={counts['skipped']}, "
+            f"duplicates={counts['duplicates']}, failed={counts['failed']})"
+        )
+        return counts
+
+    def ensure_hashes(self) -> None:
+        """为索引中的模板计算感知哈希（模板索引变化后才重新检查；阻塞调用）"""
+        self._ensure_index()
+        index = self._index
+        if self._hashed_version == self.version:
+            return
+        for template_id, template in index.items():
+            try:
+                template_hashes.update(
+                    template_id, os.path.join(self.template_dir, template["filename"])
+                )
+            except Exception as e:
+                print(f"⚠️ Template hash failed ({template_id}): {e}")
+        for key in set(template_hashes.keys()) - set(index):
+            template_hashes.remove(key)
+        template_hashes.flush()
+        self._hashed_version = self.version
+
+    def _drop_duplicates(self, entries: List[Dict[str, str]]) -> set:
+        """删除与已有模板（或本轮更早的模板）几乎相同的新模板，返回被丢弃的 id"""
+        self.ensure_hashes()
+        duplicates = set()
+        for entry in entries:
+            path = os.path.join(self.template_dir, entry["filename"])
+            try:
+                hashes = template_hashes.update(entry["id"], path)
+            except Exception as e:
+                print(f"⚠️ Template hash failed ({entry['id']}): {e}")
+                continue
+            match = template_hashes.find_duplicate(entry["id"], hashes)
+            if match is None:
                 continue
-            path = os.path.join(self.template_dir, filename)
-            if not os.path.exists(path):
+            print(f"🪞 Template {entry['id']} duplicates {match[1]} (distance={match[0]}), dropped")
+            template_hashes.remove(entry["id"])
+            os.remove(path)
+            duplicates.add(entry["id"])
+        template_hashes.flush()
+        return duplicates
+
+    def find_similar(
+        self,
+        hashes: Dict[str, int],
+        exclude: Optional[str] = None,
+        limit: int = 10,
+        max_distance: Optional[int] = None,
+    ) -> List[Dict[str, object]]:
+        """按感知哈希查找相似模板（阻塞调用）"""
+        self.ensure_hashes()
+        items = []
+        for distance, template_id in template_hashes.search(
+            hashes, max_distance=max_distance, exclude=exclude, limit=limit
+        ):
+            template = self._index.get(template_id)
+            if template is None:
                 continue
             items.append(
                 {
                     "id": template["id"],
                     "name": template["name"],
-                    "previewUrl": f"/static/templates/{filename}",
-                    "sourceUrl": template.get("sourceUrl", ""),
-                    "license": template.get("license", "Demo Only"),
+                    "previewUrl": f"/static/templates/{template['filename']}",
+                    "distance": distance,
                 }
             )
-
         return items
 
-    def get_template(self, template_id: str) -> Optional[Dict[str, str]]:
-        for template in self.templates:
-            if template["id"] == template_id:
-                path = os.path.join(self.template_dir, template["filename"])
-                if not os.path.exists(path):
-                    return None
-                return {
-                    "id": template["id"],
-                    "name": template["name"],
-                    "path": path,
-                }
-
-        for template in self.remote_index:
-            if template.get("id") == template_id:
-                filename = template.get("filename")
-                if not filename:
-                    return None
-                path = os.path.join(self.template_dir, filename)
-                if not os.path.exists(path):
-                    return None
-                return {
-                    "id": template_id,
-                    "name": template.get("name", template_id),
-                    "path": path,
-                }
+    def list_templates(self) -> List[Dict[str, str]]:
+        self._ensure_index()
+        return [
+            {
+                "id": template["id"],
+                "name": template["name"],
+                "previewUrl": f"/static/templates/{template['filename']}",
+                "sourceUrl": template["sourceUrl"],
+                "license": template["license"],
+            }
+            for template in self._index.values()
+        ]
 
-        return None
+    def get_template(self, template_id: str) -> Optional[Dict[str, str]]:
+        self._ensure_index()
+        template = self._index.get(template_id)
+        if template is None:
+            return None
+        return {
+            "id": template["id"],
+            "name": template["name"],
+            "path": os.path.join(self.template_dir, template["filename"]),
+        }
 
-    def sync_imgflip(self, limit: int = 20, force: bool = False) -> Dict[str, int]:
+    async def sync_imgflip(self, limit: int = 20, force: bool = False) -> Dict[str, int]:
         limit = max(1, min(60, int(limit)))
-        response = requests.get("https://api.imgflip.com/get_memes", timeout=30)
+        response = await http_client.get("https://api.imgflip.com/get_memes", timeout=30)
         response.raise_for_status()
         data = response.json()
 
@@ -251,10 +481,8 @@ class TemplateLibrary:
         memes = (data.get("data") or {}).get("memes") or []
         memes = memes[:limit]
 
-        added = 0
-        skipped = 0
+        jobs = []
         failed = 0
-
         for meme in memes:
             meme_id = str(meme.get("id") or "").strip()
             name = self._sanitize_name(meme.get("name") or f"imgflip-{meme_id}")
@@ -262,67 +490,33 @@ class TemplateLibrary:
             if not meme_id or not url:
                 failed += 1
                 continue
+            jobs.append((f"imgflip_{meme_id}", name, url))
 
-            template_id = f"imgflip_{meme_id}"
-            try:
-                result = self._download_remote_template(
-                    template_id=template_id,
-                    name=name,
-                    source_url=url,
-                    force=force,
-                )
-                if result == "added":
-                    added += 1
-                else:
-                    skipped += 1
-            except Exception as e:
-                print(f"⚠️ Sync imgflip template failed ({template_id}): {e}")
-                failed += 1
-
+        counts = await self._sync_remote_templates(jobs, force, "imgflip")
         return {
             "source": "imgflip",
             "requested": limit,
-            "added": added,
-            "skipped": skipped,
-            "failed": failed,
+            **counts,
+            "failed": counts["failed"] + failed,
         }
 
-    def sync_urls(self, urls: List[str], force: bool = False) -> Dict[str, int]:
+    async def sync_urls(self, urls: List[str], force: bool = False) -> Dict[str, int]:
         clean_urls = [url.strip() for url in urls if url and url.strip()]
         clean_urls = clean_urls[:60]
 
-        added = 0
-        skipped = 0
-        failed = 0
-
+        jobs = []
         for url in clean_urls:
             digest = hashlib.md5(url.encode("utf-8")).hexdigest()[:10]
             parsed = urlparse(url)
             raw_name = os.path.basename(parsed.path).rsplit(".", 1)[0]
             name = self._sanitize_name(raw_name, fallback=f"URL模板-{digest[:6]}")
-            template_id = f"url_{digest}"
-
-            try:
-                result = self._download_remote_template(
-                    template_id=template_id,
-                    name=name,
-                    source_url=url,
-                    force=force,
-                )
-                if result == "added":
-                    added += 1
-                else:
-                    skipped += 1
-            except Exception as e:
-                print(f"⚠️ Sync URL template failed ({url}): {e}")
-                failed += 1
+            jobs.append((f"url_{digest}", name, url))
 
+        counts = await self._sync_remote_templates(jobs, force, "URL")
         return {
             "source": "urls",
             "requested": len(clean_urls),
-            "added": added,
-            "skipped": skipped,
-            "failed": failed,
+            **counts,
         }
 
 
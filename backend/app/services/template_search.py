@@ -0,0 +1,256 @@
+"""
+模板模糊搜索
+- 对模板名称、id 与来源信息建立 n-gram 倒排索引（中文按单字 + 双字，其它按三字母组，
+  另索引单词内的 1~2 字符子串，短查询同样走倒排表）
+- 匹配方式：完全匹配 > 前缀 > 子串 > n-gram 相似度 / 单词编辑距离 ≤ 1（容忍拼写错误）
+- 中文名额外索引全拼与首字母（需要 pypinyin，未安装时仅按汉字匹配），如 “xiongmao”、“xmt” 可搜到 “熊猫头”
+- 模板库变化（同步、文件增删）后按差异增量更新索引
+"""
+
+import heapq
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Set, Tuple
+from urllib.parse import urlparse
+
+try:
+    from pypinyin import Style, lazy_pinyin  # 可选依赖：拼音检索
+except ImportError:
+    lazy_pinyin = None
+
+try:
+    from app.services.template_library import template_library
+except ImportError:
+    from services.template_library import template_library
+
+
+_SEGMENT_RE = re.compile(r"[㐀-鿿]+|[a-z0-9]+")
+_CJK_RE = re.compile(r"[㐀-鿿]")
+
+# 字段权重：名称 > 拼音 > 拼音首字母 > id / 来源
+FIELD_WEIGHTS = {"name": 1.0, "pinyin": 0.9, "initials": 0.8, "meta": 0.5}
+MIN_SCORE = 0.2
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").lower().strip()
+
+
+def _grams(text: str) -> Set[str]:
+    grams: Set[str] = set()
+    for segment in _SEGMENT_RE.findall(text):
+        if _CJK_RE.match(segment):
+            grams.update(segment)
+            grams.update(segment[i : i + 2] for i in range(len(segment) - 1))
+        else:
+            padded = f" {segment} "
+            grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _short_keys(text: str) -> Set[str]:
+    """非中文单词内长度 1~2 的子串（"#" 前缀），覆盖三字母组无法命中的短查询"""
+    keys: Set[str] = set()
+    for segment in _SEGMENT_RE.findall(text):
+        if _CJK_RE.match(segment):
+            continue
+        keys.update(f"#{char}" for char in segment)
+        keys.update(f"#{segment[i : i + 2]}" for i in range(len(segment) - 1))
+    return keys
+
+
+def _words(text: str) -> List[str]:
+    """参与编辑距离匹配的单词（非中文，至少 3 个字符）"""
+    return [word for word in _SEGMENT_RE.findall(text) if len(word) >= 3 and not _CJK_RE.match(word)]
+
+
+def _deletes(word: str) -> Set[str]:
+    """单词本身及删去一个字符的变体（SymSpell 方式召回编辑距离 ≤ 1 的候选）"""
+    return {word} | {word[:i] + word[i + 1 :] for i in range(len(word))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Damerau 编辑距离是否 ≤ 1（替换 / 插入 / 删除 / 相邻交换）"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return (
+            len(diff) == 2
+            and diff[1] == diff[0] + 1
+            and a[diff[0]] == b[diff[1]]
+            and a[diff[1]] == b[diff[0]]
+        )
+    if len(a) > len(b):
+        a, b = b, a
+    return any(b[:i] + b[i + 1 :] == a for i in range(len(b)))
+
+
+def _match_score(
+    query: str, query_grams: Set[str], query_words: List[str], text: str, text_grams: Set[str]
+) -> float:
+    if not text:
+        return 0.0
+    if text == query:
+        return 1.0
+    if text.startswith(query):
+        return 0.9
+    if any(word.startswith(query) for word in _SEGMENT_RE.findall(text)):
+        return 0.8
+    if query in text:
+        return 0.7
+    gram_score = 0.0
+    if query_grams:
+        gram_score = 0.6 * len(query_grams & text_grams) / len(query_grams)
+    edit_score = 0.0
+    if query_words:
+        words = _words(text)
+        matched = sum(
+            1 for query_word in query_words if any(_within_one_edit(query_word, w) for w in words)
+        )
+        edit_score = 0.5 * matched / len(query_words)
+    return max(gram_score, edit_score)
+
+
+class TemplateSearchIndex:
+    def __init__(self):
+        self.pinyin_available = lazy_pinyin is not None
+        # id → {字段: 规范化文本}
+        self._fields: Dict[str, Dict[str, str]] = {}
+        self._field_grams: Dict[str, Dict[str, Set[str]]] = {}
+        # id → 该模板写入倒排表的全部键（n-gram、"#" 前缀的短子串与 "~" 前缀的单词删除变体）
+        self._keys: Dict[str, Set[str]] = {}
+        self._templates: Dict[str, Dict[str, str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._order: Dict[str, int] = {}
+        self._version = -1
+        self._lock = threading.Lock()
+
+    def _document(self, template: Dict[str, str]) -> Dict[str, str]:
+        name = _normalize(template["name"])
+        source = template.get("sourceUrl", "")
+        host = urlparse(source).netloc if "://" in source else source
+        fields = {
+            "name": name,
+            "meta": _normalize(f"{template['id']} {host}"),
+        }
+        if self.pinyin_available and _CJK_RE.search(name):
+            fields["pinyin"] = "".join(lazy_pinyin(name))
+            fields["initials"] = "".join(lazy_pinyin(name, style=Style.FIRST_LETTER))
+        return fields
+
+    def _add(self, template: Dict[str, str]) -> None:
+        template_id = template["id"]
+        fields = self._document(template)
+        field_grams = {field: _grams(text) for field, text in fields.items()}
+        self._fields[template_id] = fields
+        self._field_grams[template_id] = field_grams
+        self._templates[template_id] = template
+        keys = set().union(*field_grams.values())
+        for text in fields.values():
+            keys.update(_short_keys(text))
+            for word in _words(text):
+                keys.update(f"~{variant}" for variant in _deletes(word))
+        self._keys[template_id] = keys
+        for key in keys:
+            self._postings.setdefault(key, set()).add(template_id)
+
+    def _remove(self, template_id: str) -> None:
+        for key in self._keys.pop(template_id, ()):
+            posting = self._postings.get(key)
+            if posting is None:
+                continue
+            posting.discard(template_id)
+            if not posting:
+                del self._postings[key]
+        self._field_grams.pop(template_id, None)
+        self._fields.pop(template_id, None)
+        self._templates.pop(template_id, None)
+
+    def refresh(self) -> None:
+        """模板库版本变化时按差异更新（只处理新增、删除与内容变化的模板）"""
+        version = template_library.get_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            templates = template_library.list_templates()
+            current = {template["id"]: template for template in templates}
+            for template_id in [key for key in self._templates if key not in current]:
+                self._remove(template_id)
+            for template_id, template in current.items():
+                if self._templates.get(template_id) == template:
+                    continue
+                self._remove(template_id)
+                self._add(template)
+            # 保持模板库顺序，用于同分时的稳定排序
+            self._order = {template_id: idx for idx, template_id in enumerate(current)}
+            self._version = version
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[int, List[Dict]]:
+        """返回 (命中总数, 当前页结果)，结果按相关度降序"""
+        self.refresh()
+        query = _normalize(query)
+        if not query:
+            return 0, []
+        query_grams = _grams(query)
+        query_words = _words(query)
+        query_keys = set(query_grams)
+        for word in query_words:
+            query_keys.update(f"~{variant}" for variant in _deletes(word))
+
+        with self._lock:
+            # 倒排表命中的候选全部打分（不截断），命中总数与分页才准确
+            candidates: Set[str] = set()
+            for key in query_keys:
+                candidates.update(self._postings.get(key, ()))
+            if len(query) < 3:
+                # 很短的查询按子串召回：单个中文片段本身就是单字 / 双字 gram，
+                # 单个非中文片段查 "#" 短子串；只有跨片段（含空格、符号或中英混合）时才逐条扫描
+                if _SEGMENT_RE.fullmatch(query):
+                    if not _CJK_RE.match(query):
+                        candidates.update(self._postings.get(f"#{query}", ()))
+                else:
+                    candidates.update(
+                        template_id
+                        for template_id, fields in self._fields.items()
+                        if any(query in text for text in fields.values())
+                    )
+
+            scored = []
+            for template_id in candidates:
+                fields = self._fields[template_id]
+                field_grams = self._field_grams[template_id]
+                score = max(
+                    FIELD_WEIGHTS[field]
+                    * _match_score(query, query_grams, query_words, text, field_grams[field])
+                    for field, text in fields.items()
+                )
+                if score >= MIN_SCORE:
+                    scored.append(
+                        (-score, self._order.get(template_id, 0), template_id, round(score, 3))
+                    )
+            # 只对当前页及之前的结果做部分排序
+            ranked = heapq.nsmallest(offset + limit, scored)
+            page = [
+                {**self._templates[template_id], "score": score}
+                for _, _, template_id, score in ranked[offset:]
+            ]
+        return len(scored), page
+
+    def get_status(self) -> Dict[str, object]:
+        return {
+            "templates": len(self._templates),
+            "grams": len(self._postings),
+            "pinyin": self.pinyin_available,
+        }
+
+
+# 全局实例
+template_search = TemplateSearchIndex()
@@ -0,0 +1,122 @@
+"""
+文字排版（自动换行）
+- 每个字体对象（即字体 + 字号）的字形前进宽度、墨迹左右边界与字距只测量一次并缓存
+- 换行单遍完成：逐字累加宽度估算当前行的 textbbox 宽度，不再每加一个字就测量整行
+- 估算值与行宽上限相差不超过 MARGIN 像素时才用 textbbox 精确测量，
+  保证断行结果与逐字测量整行完全一致
+"""
+
+import threading
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+# 估算误差容忍范围（像素），落在范围内的字符改用精确测量
+MARGIN = 3
+# 行高测量用的样例文字（与原实现一致）
+LINE_HEIGHT_SAMPLE = "测试"
+
+
+class _GlyphMetrics:
+    """单个字体对象的字形度量缓存"""
+
+    def __init__(self, font):
+        self.font = font
+        self.advances: Dict[str, float] = {}
+        # 字符 → 墨迹左右边界（无墨迹的字符如空格为 None）
+        self.ink: Dict[str, Optional[Tuple[int, int]]] = {}
+        self.kerning: Dict[Tuple[str, str], float] = {}
+        self.line_height: Optional[int] = None
+
+    def advance(self, char: str) -> float:
+        value = self.advances.get(char)
+        if value is None:
+            value = self.advances[char] = self.font.getlength(char)
+        return value
+
+    def ink_box(self, char: str) -> Optional[Tuple[int, int]]:
+        if char not in self.ink:
+            left, _, right, _ = self.font.getbbox(char)
+            self.ink[char] = (left, right) if right > left else None
+        return self.ink[char]
+
+    def kern(self, previous: str, char: str) -> float:
+        pair = (previous, char)
+        value = self.kerning.get(pair)
+        if value is None:
+            value = self.kerning[pair] = (
+                self.font.getlength(previous + char) - self.advance(previous) - self.advance(char)
+            )
+        return value
+
+
+class TextLayout:
+    def __init__(self):
+        self._metrics: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.exact_checks = 0
+
+    def metrics(self, font) -> _GlyphMetrics:
+        with self._lock:
+            metrics = self._metrics.get(font)
+            if metrics is None:
+                metrics = self._metrics[font] = _GlyphMetrics(font)
+            return metrics
+
+    def text_width(self, draw, text: str, font) -> int:
+        bbox = draw.textbbox((0, 0), text, font=font)
+        return bbox[2] - bbox[0]
+
+    def line_height(self, draw, font) -> int:
+        metrics = self.metrics(font)
+        if metrics.line_height is None:
+            bbox = draw.textbbox((0, 0), LINE_HEIGHT_SAMPLE, font=font)
+            metrics.line_height = bbox[3] - bbox[1]
+        return metrics.line_height
+
+    def wrap(self, draw, text: str, font, max_width: int) -> List[str]:
+        """按字符换行（中文无空格断词），结果与逐字测量整行 textbbox 一致"""
+        metrics = self.metrics(font)
+        lines: List[str] = []
+        current: List[str] = []
+        # 当前行的笔位置（累计前进宽度）与墨迹左右边界
+        pen = 0.0
+        ink_left: Optional[float] = None
+        ink_right: Optional[float] = None
+
+        for char in text:
+            char_pen = (pen + metrics.kern(current[-1], char)) if current else 0.0
+            box = metrics.ink_box(char)
+            left, right = ink_left, ink_right
+            if box is not None:
+                left = char_pen + box[0] if left is None else min(left, char_pen + box[0])
+                right = char_pen + box[1] if right is None else max(right, char_pen + box[1])
+            estimate = (right - left) if left is not None else 0.0
+
+            if estimate <= max_width - MARGIN:
+                fits = True
+            elif estimate > max_width + MARGIN:
+                fits = False
+            else:
+                self.exact_checks += 1
+                fits = self.text_width(draw, "".join(current) + char, font) <= max_width
+
+            if fits:
+                current.append(char)
+                pen = char_pen + metrics.advance(char)
+                ink_left, ink_right = left, right
+                continue
+
+            if current:
+                lines.append("".join(current))
+            # 新的一行从该字符开始
+            current = [char]
+            pen = metrics.advance(char)
+            ink_left, ink_right = box if box is not None else (None, None)
+
+        if current:
+            lines.append("".join(current))
+        return lines
+
+
+# 全局实例
+text_layout = TextLayout()
@@ -0,0 +1,158 @@
+"""
+缩略图（衍生图）服务
+- 为生成结果和模板按几个标准宽度生成缩略图，缓存在 static/thumbs
+- 文件名包含原图路径 + 修改时间 + 大小的哈希，原图变化后自动失效
+- 生成后可立即预生成（eager），否则在首次访问时生成（lazy）
+"""
+
+import hashlib
+import os
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+from PIL import Image
+
+try:
+    from app.services.image_encoder import image_encoder
+except ImportError:
+    from services.image_encoder import image_encoder
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+class ThumbnailService:
+    def __init__(self):
+        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        project_root = os.path.dirname(backend_dir)
+        self.static_dir = os.path.abspath(os.path.join(project_root, "static"))
+        self.thumb_dir = os.path.join(self.static_dir, "thumbs")
+        self.template_dir = os.path.join(self.static_dir, "templates")
+        os.makedirs(self.thumb_dir, exist_ok=True)
+
+        widths = os.getenv("THUMBNAIL_WIDTHS", "160,320")
+        self.widths: List[int] = sorted(
+            {int(item) for item in widths.split(",") if item.strip().isdigit() and int(item) > 0}
+        ) or [160, 320]
+        self.default_width = int(os.getenv("THUMBNAIL_DEFAULT_WIDTH", str(self.widths[-1])))
+        if self.default_width not in self.widths:
+            self.default_width = self.widths[-1]
+        self.format = os.getenv("THUMBNAIL_FORMAT", "webp")
+        self.eager = _env_flag("THUMBNAIL_EAGER", True)
+        self.generated = 0
+        # 模板缩略图单独计数：模板列表缓存只需在模板缩略图变化时失效
+        self.template_generated = 0
+        self._lock = threading.Lock()
+        print(
+            f"🖼️ ThumbnailService initialized (widths={self.widths}, format={self.format}, eager={self.eager})"
+        )
+
+    def resolve_source(self, url: str) -> Optional[str]:
+        """把 /static/... URL 解析为 static 目录下的文件路径（拒绝越界路径与缩略图自身）"""
+        marker = "/static/"
+        if marker not in url:
+            return None
+        relative = url.split(marker, 1)[1].split("?", 1)[0]
+        path = os.path.abspath(os.path.join(self.static_dir, relative))
+        if not path.startswith(self.static_dir + os.sep):
+            return None
+        if path.startswith(self.thumb_dir + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _thumb_path(self, source_path: str, width: int) -> str:
+        stat = os.stat(source_path)
+        relative = os.path.relpath(source_path, self.static_dir)
+        digest = hashlib.sha1(
+            f"{relative}|{stat.st_mtime_ns}|{stat.st_size}".encode("utf-8")
+        ).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(source_path))[0][:40]
+        ext = image_encoder.extension(self.format)
+        return os.path.join(self.thumb_dir, f"{stem}_{digest}_w{width}{ext}")
+
+    def _to_url(self, path: str) -> str:
+        relative = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+        return f"/static/{relative}"
+
+    def ensure(self, source_path: str, width: int) -> str:
+        """返回缩略图路径，不存在时生成（阻塞调用，异步环境中放到线程池）"""
+        if width not in self.widths:
+            raise ValueError(f"Unsupported thumbnail width: {width}")
+        thumb_path = self._thumb_path(source_path, width)
+        if os.path.exists(thumb_path):
+            return thumb_path
+
+        with Image.open(source_path) as image:
+            src_width, src_height = image.size
+            height = max(1, round(src_height * width / src_width))
+            # JPEG 可以在解码时直接按比例缩小，省掉大部分解码开销
+            image.draft("RGB", (width, height))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            if src_width > width:
+                image = image.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+            data, _ = image_encoder.encode(image, self.format)
+
+        tmp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, thumb_path)
+        with self._lock:
+            self.generated += 1
+            if source_path.startswith(self.template_dir + os.sep):
+                self.template_generated += 1
+        return thumb_path
+
+    def ensure_all(self, source_path: str) -> None:
+        """预生成全部标准宽度（生成完成后调用）"""
+        for width in self.widths:
+            try:
+                self.ensure(source_path, width)
+            except Exception as e:
+                print(f"⚠️ Thumbnail generation failed for {source_path}: {e}")
+                return
+
+    def existing_paths(self, source_path: str) -> List[str]:
+        """原图当前版本已生成的缩略图路径（原图删除前调用，用于一并清理）"""
+        try:
+            candidates = [self._thumb_path(source_path, width) for width in self.widths]
+        except OSError:
+            return []
+        return [path for path in candidates if os.path.exists(path)]
+
+    def urls_for(self, url: str) -> Dict[str, object]:
+        """
+        原图 URL 对应的缩略图 URL
+
+        已生成的直接返回静态文件地址，未生成的返回按需生成接口地址
+        """
+        source_path = self.resolve_source(url) if url else None
+        if source_path is None:
+            return {"thumbnailUrl": url, "thumbnails": {}}
+        thumbnails = {}
+        for width in self.widths:
+            thumb_path = self._thumb_path(source_path, width)
+            if os.path.exists(thumb_path):
+                thumbnails[str(width)] = self._to_url(thumb_path)
+            else:
+                thumbnails[str(width)] = f"/api/thumbnail?src={quote(url, safe='/')}&w={width}"
+        return {"thumbnailUrl": thumbnails[str(self.default_width)], "thumbnails": thumbnails}
+
+    def get_status(self) -> Dict[str, object]:
+        return {
+            "widths": self.widths,
+            "defaultWidth": self.default_width,
+            "format": self.format,
+            "eager": self.eager,
+            "generated": self.generated,
+            "templateGenerated": self.template_generated,
+        }
+
+
+# 全局实例
+thumbnail_service = ThumbnailService()
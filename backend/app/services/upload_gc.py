@@ -0,0 +1,321 @@
+"""
+上传目录垃圾回收
+- 定期清理 static/uploads 中不再被历史记录引用的文件（超过宽限期才清理，避免误删进行中的生成结果）
+- 增量清扫：目录游标跨轮次保留，每轮只检查 UPLOAD_GC_SCAN_CHUNK 个文件，
+  并且只按这一批文件名查询历史记录引用；一轮耗时取决于批大小，而不是目录与历史的总量
+- 已检查过的文件记录大小与最近访问时间，总占用超过配额时按 LRU 淘汰，被淘汰图片对应的历史记录一并删除
+- 删除图片时一并删除其缩略图，并从生成结果的感知哈希索引中移除；缩略图目录同样按游标分批清理孤立文件
+- 扫描与删除分批在线程池中执行，不阻塞请求处理；记录回收字节数与耗时
+"""
+
+import asyncio
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    from app.models.meme import meme_storage
+    from app.services.image_hash import output_hashes
+    from app.services.thumbnail_service import thumbnail_service
+except ImportError:
+    from models.meme import meme_storage
+    from services.image_hash import output_hashes
+    from services.thumbnail_service import thumbnail_service
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+# (路径, 文件名, 字节数, 最近访问时间, 是否最后一个硬链接)
+FileInfo = Tuple[str, str, int, float, bool]
+
+
+def _stem(name: str) -> str:
+    """缩略图文件名使用的原图前缀（与 ThumbnailService 一致）"""
+    return os.path.splitext(name)[0][:40]
+
+
+class UploadGarbageCollector:
+    def __init__(self):
+        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        project_root = os.path.dirname(backend_dir)
+        static_dir = os.path.join(project_root, "static")
+        self.upload_dir = os.path.join(static_dir, "uploads")
+        self.template_dir = os.path.join(static_dir, "templates")
+        self.thumb_dir = thumbnail_service.thumb_dir
+
+        self.enabled = _env_flag("UPLOAD_GC_ENABLED", True)
+        self.interval = float(os.getenv("UPLOAD_GC_INTERVAL", "600"))
+        self.quota_bytes = int(os.getenv("UPLOAD_QUOTA_BYTES", str(1024 * 1024 * 1024)))
+        self.min_age = float(os.getenv("UPLOAD_GC_MIN_AGE", "3600"))
+        self.batch_size = max(1, int(os.getenv("UPLOAD_GC_BATCH", "200")))
+        self.scan_chunk = max(1, int(os.getenv("UPLOAD_GC_SCAN_CHUNK", "1000")))
+
+        self.runs = 0
+        self.cycles = 0
+        self.last_run_at: Optional[float] = None
+        self.last_duration = 0.0
+        self.last_reclaimed = 0
+        self.last_deleted = 0
+        self.last_examined = 0
+        self.total_reclaimed = 0
+        self.total_deleted = 0
+        self.usage_bytes = 0
+        self._task: Optional[asyncio.Task] = None
+        self._running: Optional[asyncio.Lock] = None
+
+        # 目录游标：跨轮次保留的 scandir 迭代器，遍历完一遍后重新打开
+        self._iterators: Dict[str, Iterator[os.DirEntry]] = {}
+        # 已检查过的上传文件：文件名 → (字节数, 最近访问时间, 是否最后一个硬链接)
+        self._known: Dict[str, Tuple[int, float, bool]] = {}
+        self._known_stems: Counter = Counter()
+        # 当前一遍清扫中见过的文件；一遍结束时据此剔除已不存在的文件
+        self._cycle_seen: Set[str] = set()
+        self._cycle_started = 0.0
+        # 最近一次完整清扫的开始时间：早于它的上传文件若仍存在，必然在 _known 中
+        self._complete_since: Optional[float] = None
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            print(
+                f"🧹 Upload GC started (interval={self.interval:g}s, quota={self.quota_bytes} bytes)"
+            )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for iterator in self._iterators.values():
+            iterator.close()
+        self._iterators.clear()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Upload GC failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _next_chunk(self, directory: str) -> Tuple[List[FileInfo], bool]:
+        """从目录游标处继续读取最多 scan_chunk 个条目，返回 (文件, 是否已遍历完一遍)"""
+        iterator = self._iterators.pop(directory, None)
+        if iterator is None:
+            try:
+                iterator = os.scandir(directory)
+            except FileNotFoundError:
+                return [], True
+        files = []
+        for _ in range(self.scan_chunk):
+            try:
+                entry = next(iterator)
+            except StopIteration:
+                iterator.close()
+                return files, True
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            last_used = max(stat.st_atime, stat.st_mtime)
+            files.append((entry.path, entry.name, stat.st_size, last_used, stat.st_nlink <= 1))
+        self._iterators[directory] = iterator
+        return files, False
+
+    def _track(self, info: FileInfo) -> None:
+        _, name, size, last_used, last_link = info
+        self._forget(name)
+        self._known[name] = (size, last_used, last_link)
+        self._known_stems[_stem(name)] += 1
+        self.usage_bytes += size
+
+    def _forget(self, name: str) -> None:
+        known = self._known.pop(name, None)
+        if known is None:
+            return
+        self.usage_bytes -= known[0]
+        stem = _stem(name)
+        self._known_stems[stem] -= 1
+        if self._known_stems[stem] <= 0:
+            del self._known_stems[stem]
+
+    def _delete_batch(self, batch: List[FileInfo], with_thumbnails: bool) -> Tuple[int, List[str]]:
+        reclaimed = 0
+        deleted = []
+        for path, name, size, _, last_link in batch:
+            # 缩略图文件名依赖原图的修改时间与大小，需在删除原图前计算
+            thumbs = thumbnail_service.existing_paths(path) if with_thumbnails else []
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            deleted.append(name)
+            # 与结果缓存共享硬链接的文件删除后并不释放空间
+            if last_link:
+                reclaimed += size
+            for thumb in thumbs:
+                try:
+                    thumb_size = os.path.getsize(thumb)
+                    os.remove(thumb)
+                except OSError:
+                    continue
+                reclaimed += thumb_size
+        return reclaimed, deleted
+
+    async def _delete(self, files: List[FileInfo], uploads: bool = False) -> Tuple[int, int]:
+        """分批删除文件；uploads=True 时同时删除缩略图、移出哈希索引并停止跟踪"""
+        reclaimed = 0
+        deleted: List[str] = []
+        for start in range(0, len(files), self.batch_size):
+            batch_reclaimed, batch_deleted = await asyncio.to_thread(
+                self._delete_batch, files[start : start + self.batch_size], uploads
+            )
+            reclaimed += batch_reclaimed
+            deleted.extend(batch_deleted)
+            await asyncio.sleep(0)
+        if uploads and deleted:
+            for name in deleted:
+                self._forget(name)
+            await asyncio.to_thread(output_hashes.remove_many, deleted)
+        return reclaimed, len(deleted)
+
+    def _pick_evictions(self, now: float) -> List[FileInfo]:
+        """超出配额时按最近访问时间挑选淘汰对象（只在超额时排序；候选重新 stat，跳过刚被访问的）"""
+        excess = self.usage_bytes - self.quota_bytes
+        picked = []
+        for name, _ in sorted(self._known.items(), key=lambda item: item[1][1]):
+            if excess <= 0:
+                break
+            path = os.path.join(self.upload_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._forget(name)
+                continue
+            info = (path, name, stat.st_size, max(stat.st_atime, stat.st_mtime), stat.st_nlink <= 1)
+            self._track(info)
+            if now - info[3] <= self.min_age:
+                continue
+            picked.append(info)
+            excess -= info[2]
+        return picked
+
+    def _template_stems(self) -> Set[str]:
+        try:
+            return {_stem(name) for name in os.listdir(self.template_dir)}
+        except FileNotFoundError:
+            return set()
+
+    async def run_once(self) -> Dict[str, object]:
+        """执行一轮增量回收，返回本轮统计"""
+        if self._running is None:
+            self._running = asyncio.Lock()
+        async with self._running:
+            started = time.monotonic()
+            now = time.time()
+
+            # 1. 从游标处取一批上传文件，只查询这一批的历史引用
+            if not self._cycle_seen:
+                self._cycle_started = now
+            chunk, wrapped = await asyncio.to_thread(self._next_chunk, self.upload_dir)
+            for info in chunk:
+                self._track(info)
+                self._cycle_seen.add(info[1])
+            referenced = await asyncio.to_thread(
+                meme_storage.referenced_image_names, [info[1] for info in chunk]
+            )
+            orphans = [
+                info
+                for info in chunk
+                if info[1] not in referenced and now - info[3] > self.min_age
+            ]
+            reclaimed, deleted = await self._delete(orphans, uploads=True)
+
+            if wrapped:
+                # 遍历完一遍：剔除期间已被删除、未再出现的文件
+                for name in [name for name in self._known if name not in self._cycle_seen]:
+                    self._forget(name)
+                self._cycle_seen.clear()
+                self._complete_since = self._cycle_started
+                self.cycles += 1
+
+            # 2. 超出配额时按 LRU 淘汰（连同历史记录）
+            if self.quota_bytes > 0 and self.usage_bytes > self.quota_bytes:
+                evicted = await asyncio.to_thread(self._pick_evictions, now)
+                if evicted:
+                    await asyncio.to_thread(
+                        meme_storage.delete_by_image_names, [info[1] for info in evicted]
+                    )
+                    evicted_reclaimed, evicted_deleted = await self._delete(evicted, uploads=True)
+                    reclaimed += evicted_reclaimed
+                    deleted += evicted_deleted
+
+            # 3. 缩略图目录同样分批：源图已不存在的缩略图
+            #    需要至少完整清扫过一遍上传目录，且只处理早于该遍开始时间的缩略图
+            thumbs, _ = await asyncio.to_thread(self._next_chunk, self.thumb_dir)
+            if self._complete_since is not None and thumbs:
+                live_stems = await asyncio.to_thread(self._template_stems)
+                stale_thumbs = [
+                    info
+                    for info in thumbs
+                    if info[1].rsplit("_", 2)[0] not in live_stems
+                    and info[1].rsplit("_", 2)[0] not in self._known_stems
+                    and info[3] < self._complete_since
+                    and now - info[3] > self.min_age
+                ]
+                thumb_reclaimed, thumb_deleted = await self._delete(stale_thumbs)
+                reclaimed += thumb_reclaimed
+                deleted += thumb_deleted
+
+            self.runs += 1
+            self.last_run_at = now
+            self.last_duration = time.monotonic() - started
+            self.last_reclaimed = reclaimed
+            self.last_deleted = deleted
+            self.last_examined = len(chunk) + len(thumbs)
+            self.total_reclaimed += reclaimed
+            self.total_deleted += deleted
+            if deleted:
+                print(
+                    f"🧹 Upload GC removed {deleted} files, reclaimed {reclaimed} bytes in {self.last_duration:.2f}s"
+                )
+            return {
+                "examined": self.last_examined,
+                "deleted": deleted,
+                "reclaimedBytes": reclaimed,
+                "durationMs": round(self.last_duration * 1000, 2),
+            }
+
+    def get_status(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "quotaBytes": self.quota_bytes,
+            "minAge": self.min_age,
+            "scanChunk": self.scan_chunk,
+            "usageBytes": self.usage_bytes,
+            "files": len(self._known),
+            "runs": self.runs,
+            "cycles": self.cycles,
+            "lastRunAt": self.last_run_at,
+            "lastDurationMs": round(self.last_duration * 1000, 2),
+            "lastExamined": self.last_examined,
+            "lastDeleted": self.last_deleted,
+            "lastReclaimedBytes": self.last_reclaimed,
+            "totalDeleted": self.total_deleted,
+            "totalReclaimedBytes": self.total_reclaimed,
+        }
+
+
+# 全局实例
+upload_gc = UploadGarbageCollector()
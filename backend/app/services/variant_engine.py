@@ -0,0 +1,73 @@
+"""
+变体并发生成引擎
+- 单次请求内的多个变体并发执行（asyncio）
+- 单请求并发上限 + 进程级全局并发上限
+- 结果按 variantIndex 排序，单个变体失败不影响其它变体
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, List, Optional, TypeVar, Union
+
+T = TypeVar("T")
+
+VariantOutcome = Union[T, BaseException]
+
+
+class VariantEngine:
+    def __init__(
+        self,
+        global_limit: Optional[int] = None,
+        request_limit: Optional[int] = None,
+    ):
+        self.global_limit = max(
+            1, int(global_limit or os.getenv("VARIANT_GLOBAL_CONCURRENCY", "8"))
+        )
+        self.request_limit = max(
+            1, int(request_limit or os.getenv("VARIANT_REQUEST_CONCURRENCY", "3"))
+        )
+        self._global_semaphore: Optional[asyncio.Semaphore] = None
+        print(
+            f"🧵 VariantEngine initialized (global={self.global_limit}, per_request={self.request_limit})"
+        )
+
+    def _get_global_semaphore(self) -> asyncio.Semaphore:
+        # 延迟创建，确保绑定到运行中的事件循环
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(self.global_limit)
+        return self._global_semaphore
+
+    async def run(
+        self,
+        count: int,
+        worker: Callable[[int], Awaitable[T]],
+        request_limit: Optional[int] = None,
+    ) -> List[VariantOutcome]:
+        """
+        并发执行 count 个变体
+
+        Args:
+            count: 变体数量
+            worker: 接收 variantIndex 的协程工厂
+            request_limit: 覆盖默认的单请求并发上限
+
+        Returns:
+            按 variantIndex 排序的结果列表，失败的变体位置为异常对象
+        """
+        limit = max(1, int(request_limit or self.request_limit))
+        request_semaphore = asyncio.Semaphore(limit)
+        global_semaphore = self._get_global_semaphore()
+
+        async def _run_one(idx: int) -> T:
+            async with request_semaphore:
+                async with global_semaphore:
+                    return await worker(idx)
+
+        return await asyncio.gather(
+            *[_run_one(idx) for idx in range(count)],
+            return_exceptions=True,
+        )
+
+
+# 全局实例
+variant_engine = VariantEngine()
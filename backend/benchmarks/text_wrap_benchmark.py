@@ -0,0 +1,152 @@
+"""
+文字换行基准测试：逐字测量整行（原实现）vs 缓存字形宽度的单遍换行（text_layout）
+
+用法（在 backend 目录下）：
+    python benchmarks/text_wrap_benchmark.py [--rounds 5]
+
+- 先校验两种实现在所有自适应字号、多种行宽下的断行结果完全一致
+- 再分别统计单次换行与完整 _fit_text 的耗时
+- 使用 MEME_FONT_PATH 或 font_registry 找到的第一个字体
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.font_registry import font_registry  # noqa: E402
+from app.services.image_processor import (  # noqa: E402
+    FIT_FONT_STEP,
+    FIT_MAX_FONT_SIZE,
+    FIT_MIN_FONT_SIZE,
+    image_processor,
+)
+from app.services.text_layout import text_layout  # noqa: E402
+
+CAPTIONS = {
+    "cjk-short": "我太难了",
+    "cjk-medium": "当你以为今天终于可以准时下班的时候，老板突然走过来说我们再对一下需求",
+    "latin": "When the code works on the first try and you have no idea why it works at all",
+    "mixed": "周一早上 9:00 的 standup：昨天干了啥？今天干啥？有 blocker 吗？没有，谢谢大家！",
+    "punctuation": "「啊？」「真的假的？！」……「好吧。」——然后就没有然后了。",
+}
+LONG_CAPTION = CAPTIONS["cjk-medium"] * 10
+
+
+def legacy_wrap(draw, text, font, max_width):
+    """原实现：每加一个字符都用 textbbox 重新测量整行（O(n²)）"""
+    lines = []
+    current = ""
+    for char in text:
+        test = f"{current}{char}"
+        bbox = draw.textbbox((0, 0), test, font=font)
+        if bbox[2] - bbox[0] <= max_width:
+            current = test
+        else:
+            if current:
+                lines.append(current)
+            current = char
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _sizes():
+    return list(range(FIT_MAX_FONT_SIZE, FIT_MIN_FONT_SIZE - 1, -FIT_FONT_STEP))
+
+
+def check_equivalence(draw) -> int:
+    texts = dict(CAPTIONS, long=LONG_CAPTION)
+    cases = 0
+    for size in _sizes():
+        font = font_registry.get(size)
+        for max_width in range(40, 820, 19):
+            for name, text in texts.items():
+                expected = legacy_wrap(draw, text, font, max_width)
+                actual = text_layout.wrap(draw, text, font, max_width)
+                if expected != actual:
+                    raise SystemExit(
+                        f"❌ Mismatch: caption={name} size={size} width={max_width}\n"
+                        f"   legacy: {expected}\n   layout: {actual}"
+                    )
+                cases += 1
+    return cases
+
+
+def _time(func, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_wrap(draw, rounds: int) -> None:
+    max_width = 400
+    print(f"\n{'caption':<14}{'chars':>6}{'legacy ms':>12}{'layout ms':>12}{'speedup':>10}")
+    for name, text in dict(CAPTIONS, long=LONG_CAPTION).items():
+
+        def run_legacy():
+            for size in _sizes():
+                legacy_wrap(draw, text, font_registry.get(size), max_width)
+
+        def run_layout():
+            for size in _sizes():
+                text_layout.wrap(draw, text, font_registry.get(size), max_width)
+
+        legacy_ms = _time(run_legacy, rounds)
+        layout_ms = _time(run_layout, rounds)
+        print(
+            f"{name:<14}{len(text):>6}{legacy_ms:>12.2f}{layout_ms:>12.2f}"
+            f"{legacy_ms / layout_ms:>9.1f}x"
+        )
+
+
+def bench_fit(rounds: int) -> None:
+    """完整的自适应字号流程（512x512 图片，默认字号 32）"""
+    image = Image.new("RGB", (512, 512), "white")
+    draw = ImageDraw.Draw(image)
+    font = font_registry.get(image_processor.default_font_size)
+    max_width, max_height = int(512 * 0.8), int(512 * 0.3)
+
+    def run_fit():
+        for text in CAPTIONS.values():
+            image_processor._fit_text(draw, text, font, max_width, max_height)
+
+    original = image_processor._wrap_text
+    image_processor._wrap_text = legacy_wrap
+    try:
+        legacy_ms = _time(run_fit, rounds)
+    finally:
+        image_processor._wrap_text = original
+    layout_ms = _time(run_fit, rounds)
+    print(
+        f"\n_fit_text ({len(CAPTIONS)} captions): legacy {legacy_ms:.2f} ms, "
+        f"layout {layout_ms:.2f} ms ({legacy_ms / layout_ms:.1f}x)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"🔤 Font: {font_registry.path or 'Pillow default'}")
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    # 预热字体与字形缓存，计时只比较换行本身
+    for size in _sizes():
+        text_layout.wrap(draw, LONG_CAPTION + "".join(CAPTIONS.values()), font_registry.get(size), 400)
+
+    cases = check_equivalence(draw)
+    print(f"✅ Identical line breaks in {cases} cases (exact fallbacks: {text_layout.exact_checks})")
+    bench_wrap(draw, args.rounds)
+    bench_fit(args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+模板模糊搜索：命中数超过一页 / 超过旧的候选上限时，总数与分页必须准确
+运行：在 backend 目录下执行 python -m pytest -q
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import template_search as search_module  # noqa: E402
+
+
+class _FakeLibrary:
+    def __init__(self, templates):
+        self.templates = templates
+
+    def get_version(self):
+        return 1
+
+    def list_templates(self):
+        return [dict(template) for template in self.templates]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    templates = [
+        {"id": f"cat_{i:04d}", "name": f"cat {i}", "sourceUrl": ""} for i in range(1200)
+    ] + [{"id": "dog_0001", "name": "dog", "sourceUrl": ""}]
+    monkeypatch.setattr(search_module, "template_library", _FakeLibrary(templates))
+    return search_module.TemplateSearchIndex()
+
+
+def test_total_counts_every_match(index):
+    total, page = index.search("cat", limit=20, offset=0)
+    assert total == 1200
+    assert len(page) == 20
+
+
+def test_pages_beyond_500_are_reachable(index):
+    seen = set()
+    for offset in range(0, 1200, 100):
+        total, page = index.search("cat", limit=100, offset=offset)
+        assert total == 1200
+        assert len(page) == 100
+        seen.update(item["id"] for item in page)
+    assert len(seen) == 1200
+
+    total, page = index.search("cat", limit=20, offset=1190)
+    assert [item["id"] for item in page] == [f"cat_{i:04d}" for i in range(1190, 1200)]
+    assert index.search("cat", limit=20, offset=1200)[1] == []
+
+
+class _NoScanFields(dict):
+    def items(self):
+        raise AssertionError("short query fell back to a linear scan")
+
+
+def test_short_queries_come_from_the_index(monkeypatch):
+    names = ["熊猫头", "大熊猫", "熊出没", "猫猫", "doge", "cat 1", "big cat", "熊猫 dog"]
+    templates = [{"id": f"t{i:02d}", "name": name, "sourceUrl": ""} for i, name in enumerate(names)]
+    monkeypatch.setattr(search_module, "template_library", _FakeLibrary(templates))
+    index = search_module.TemplateSearchIndex()
+    index.refresh()
+    # 期望结果：逐条子串扫描（含拼音字段）能找到的模板
+    fields = dict(index._fields)
+    index._fields = _NoScanFields(fields)
+
+    for query in ["熊猫", "熊", "猫猫", "at", "do", "g", "1"]:
+        total, page = index.search(query, limit=20)
+        expected = {
+            template_id
+            for template_id, texts in fields.items()
+            if any(query in text for text in texts.values())
+        }
+        assert expected, query
+        # 子串命中全部召回且排在 n-gram 相似度命中之前
+        assert total == len(page) >= len(expected), query
+        assert {item["id"] for item in page[: len(expected)]} == expected, query
@@ -256,7 +256,7 @@ const App: React.FC = () => {
                   aria-pressed={selectedTemplate === item.id}
                   aria-label={`选择模板 ${item.name}`}
                 >
-                  <img src={item.previewUrl} alt={item.name} />
+                  <img src={item.thumbnailUrl || item.previewUrl} alt={item.name} />
                   <span>{item.name}</span>
                 </button>
               ))}
@@ -50,7 +50,8 @@ const DownloadComponent: React.FC<DownloadProps> = ({
       const url = window.URL.createObjectURL(blob);
       const link = document.createElement('a');
       link.href = url;
-      link.download = `meme-${Date.now()}.png`;
+      const ext = urlToDownload.split('?')[0].match(/\.(png|jpe?g|webp|avif)$/i)?.[1] ?? 'png';
+      link.download = `meme-${Date.now()}.${ext}`;
       document.body.appendChild(link);
       link.click();
       document.body.removeChild(link);
@@ -11,6 +11,8 @@ interface HistoryItem {
   provider?: string;
   isMock?: boolean;
   styleStrength?: number;
+  thumbnailUrl?: string;
+  thumbnails?: Record<string, string>;
 }
 
 interface HistoryProps {
@@ -58,7 +60,7 @@ const HistoryComponent: React.FC<HistoryProps> = ({
               aria-label={`查看历史记录：${item.prompt}`}
             >
               <img
-                src={item.imageUrl}
+                src={item.thumbnailUrl || item.imageUrl}
                 alt={item.prompt}
                 className="history-thumbnail"
               />
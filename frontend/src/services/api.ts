@@ -42,12 +42,16 @@ export interface HistoryItem {
   provider?: string;
   isMock?: boolean;
   styleStrength?: number;
+  thumbnailUrl?: string;
+  thumbnails?: Record<string, string>;
 }
 
 export interface TemplateItem {
   id: string;
   name: string;
   previewUrl: string;
+  thumbnailUrl?: string;
+  thumbnails?: Record<string, string>;
   sourceUrl?: string;
   license?: string;
 }